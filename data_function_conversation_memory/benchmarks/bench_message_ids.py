@@ -0,0 +1,115 @@
+"""
+Compare random UUIDv4 and time-ordered UUIDv7 message IDs on SQLite, the
+engine behind Cloudflare D1.
+
+Inserts the same rows into two fresh databases using the plugin's own Message
+schema, differing only in how message_id is generated, and reports insert
+throughput (overall and for the last 10% of the run) plus the size and page
+fill of the primary key index and the size of the whole database.
+
+Run from the plugin root:
+
+    python -m benchmarks.bench_message_ids --rows 1000000
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+import uuid
+from datetime import datetime
+
+from utils.core import CONVERSATION_TABLE_SQL, MESSAGE_TABLE_SQL, new_id
+
+MESSAGES_PER_CONVERSATION = 100
+
+
+def _insert(path: str, ids: list, batch: int, cache_mb: int) -> dict:
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute(f"PRAGMA cache_size = -{cache_mb * 1024}")
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute(CONVERSATION_TABLE_SQL)
+    conn.execute(MESSAGE_TABLE_SQL)
+
+    conversations = (len(ids) + MESSAGES_PER_CONVERSATION - 1) // MESSAGES_PER_CONVERSATION
+    conn.execute("BEGIN")
+    conn.executemany(
+        "INSERT INTO Conversation (conversation_id) VALUES (?);",
+        ((f"conversation-{i:08d}",) for i in range(conversations)),
+    )
+    conn.execute("COMMIT")
+
+    timestamp = datetime.now().isoformat()
+    segment = max(len(ids) // 10, 1)
+    segments = []
+    segment_start = start = time.perf_counter()
+    for offset in range(0, len(ids), batch):
+        chunk = ids[offset : offset + batch]
+        conn.execute("BEGIN")
+        conn.executemany(
+            "INSERT INTO Message (message_id, conversation_id, role, text, timestamp, seq) "
+            "VALUES (?, ?, 'user', 'hello world', ?, ?);",
+            (
+                (
+                    message_id,
+                    f"conversation-{(offset + i) // MESSAGES_PER_CONVERSATION:08d}",
+                    timestamp,
+                    (offset + i) % MESSAGES_PER_CONVERSATION + 1,
+                )
+                for i, message_id in enumerate(chunk)
+            ),
+        )
+        conn.execute("COMMIT")
+        done = offset + len(chunk)
+        if done % segment < batch or done == len(ids):
+            now = time.perf_counter()
+            segments.append(segment / (now - segment_start))
+            segment_start = now
+    elapsed = time.perf_counter() - start
+
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    pk_bytes, pk_unused, pk_pages = conn.execute(
+        "SELECT SUM(pgsize), SUM(unused), COUNT(*) FROM dbstat "
+        "WHERE name = 'sqlite_autoindex_Message_1';"
+    ).fetchone()
+    conn.close()
+    return {
+        "rows_per_second": len(ids) / elapsed,
+        "segments": segments,
+        "pk_index_bytes": pk_bytes,
+        "pk_index_pages": pk_pages,
+        "pk_index_fill": 1 - pk_unused / pk_bytes,
+        "database_bytes": os.path.getsize(path),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--batch", type=int, default=10_000, help="rows per transaction")
+    parser.add_argument("--cache-mb", type=int, default=2, help="SQLite page cache size")
+    args = parser.parse_args()
+
+    generators = {
+        "uuid4": lambda: str(uuid.uuid4()),
+        "uuid7": new_id,
+    }
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for name, generate in generators.items():
+            ids = [generate() for _ in range(args.rows)]
+            results[name] = _insert(os.path.join(directory, f"{name}.db"), ids, args.batch, args.cache_mb)
+
+    print(f"rows={args.rows} batch={args.batch} cache={args.cache_mb}MB")
+    print(f"{'':8}{'rows/s':>12}{'last 10% rows/s':>18}{'pk index MB':>14}{'pk pages':>10}{'pk fill':>9}{'db MB':>9}")
+    for name, result in results.items():
+        print(
+            f"{name:8}{result['rows_per_second']:>12,.0f}{result['segments'][-1]:>18,.0f}"
+            f"{result['pk_index_bytes'] / 2**20:>14.1f}{result['pk_index_pages']:>10,}"
+            f"{result['pk_index_fill']:>9.0%}"
+            f"{result['database_bytes'] / 2**20:>9.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Compare the history renderers with the string building GetConversationTool
+used before them, on large synthetic histories.
+
+The previous path built one f-string per message, joined them, then rebuilt
+the whole string to wrap it in <history> and append <latest>; in json mode it
+built the list and serialized it with json.dumps. The renderer escapes the
+text, writes the wrapper in the same pass and encodes JSON with orjson (a
+plugin requirement; the report says whether it was importable).
+Timings cover rendering only, from the Conversation object to the text.
+
+Run from the plugin root:
+
+    python -m benchmarks.bench_render --messages 2000 --text-bytes 2000
+"""
+import argparse
+import json
+import time
+from datetime import datetime
+from typing import Callable, List
+
+from utils.core import (
+    dumps_json,
+    history_json_list,
+    message_pairs,
+    render_history_text,
+)
+from utils.core.conversation_storage_dataclasses import Conversation, Message
+from utils.core.conversation_storage_render import orjson
+
+
+def _conversation(messages: int, text_bytes: int) -> Conversation:
+    unit = "Compare a < b && c > d, then say hello. "
+    text = (unit * (text_bytes // len(unit) + 1))[:text_bytes]
+    now = datetime.now()
+    conversation = Conversation(conversation_id="bench")
+    conversation.messages = [
+        Message(
+            conversation_id="bench",
+            role="user" if i % 2 == 0 else "assistant",
+            text=f"{i}: {text}",
+            timestamp=now,
+            seq=i + 1,
+        )
+        for i in range(messages)
+    ]
+    return conversation
+
+
+def _legacy_xml(conversation: Conversation, user_input: str) -> str:
+    result = []
+    for msg in conversation.messages:
+        message_xml = f"""<message>
+    <role>{msg.role}</role>
+    <content>{msg.text}</content>
+</message>"""
+        result.append(message_xml)
+    content = "\n".join(result)
+    content = f"<history>\n{content}\n</history>"
+    user_message_xml = f"""<latest><message>
+    <role>user</role>
+    <content>{user_input}</content>
+</message></latest>"""
+    return f"{content}\n{user_message_xml}"
+
+
+def _legacy_json(conversation: Conversation, user_input: str) -> str:
+    messages = [{"role": msg.role, "content": msg.text} for msg in conversation.messages]
+    messages.append({"role": "user", "content": user_input})
+    return json.dumps(messages, ensure_ascii=False)
+
+
+def _time(fn: Callable[[], str], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark history rendering")
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--text-bytes", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=20, help="best of N runs is reported")
+    args = parser.parse_args(argv)
+
+    conversation = _conversation(args.messages, args.text_bytes)
+    user_input = "What about x < y?"
+    cases = [
+        ("xml  legacy (unescaped)", lambda: _legacy_xml(conversation, user_input)),
+        ("xml  renderer", lambda: render_history_text(message_pairs(conversation), "xml", user_input)),
+        ("json legacy json.dumps", lambda: _legacy_json(conversation, user_input)),
+        ("json renderer", lambda: dumps_json(history_json_list(message_pairs(conversation), user_input))),
+        ("json streamed", lambda: render_history_text(message_pairs(conversation), "json", user_input)),
+        ("chat renderer", lambda: render_history_text(message_pairs(conversation), "chat", user_input)),
+    ]
+
+    size = args.messages * args.text_bytes / 1e6
+    print(f"{args.messages} messages, ~{size:.1f} MB of text, orjson {'on' if orjson else 'off'}")
+    for name, fn in cases:
+        seconds = _time(fn, args.repeat)
+        print(f"{name:<26} {seconds * 1000:8.2f} ms  {size / seconds:8.1f} MB/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+Local stand-in for the Cloudflare D1 REST query endpoint, backed by SQLite.
+
+Serves POST /client/v4/accounts/<account>/d1/database/<database>/query with
+both the single {"sql", "params"} body and the {"batch": [...]} body, and
+answers in the same envelope as D1. Like D1, statements run one at a time
+and a request is one transaction. Point the plugin at it with:
+
+    CLOUDFLARE_API_BASE_URL=http://127.0.0.1:8787/client/v4
+
+Run standalone from the plugin root:
+
+    python -m benchmarks.d1_standin --db /tmp/d1.sqlite3 --port 8787
+"""
+import argparse
+import json
+import re
+import sqlite3
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+_QUERY_PATH = re.compile(r"^/client/v4/accounts/[^/]+/d1/database/[^/]+/query$")
+
+
+class D1StandIn:
+    """SQLite database that executes D1 query request bodies."""
+
+    def __init__(self, path: str, latency_ms: float = 0.0):
+        self.path = path
+        self.latency = latency_ms / 1000
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.execute("PRAGMA foreign_keys = ON")
+
+    def execute(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        statements = body["batch"] if "batch" in body else [body]
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                results = [self._run(s["sql"], s.get("params") or []) for s in statements]
+                self._conn.execute("COMMIT")
+            except sqlite3.Error as e:
+                self._conn.execute("ROLLBACK")
+                return {
+                    "success": False,
+                    "errors": [{"code": 7500, "message": f"{e}: SQLITE_ERROR"}],
+                    "messages": [],
+                    "result": [],
+                }
+        return {"success": True, "errors": [], "messages": [], "result": results}
+
+    def _run(self, sql: str, params: List[Any]) -> Dict[str, Any]:
+        started = time.perf_counter()
+        changes_before = self._conn.total_changes
+        cursor = self._conn.execute(sql, params)
+        rows = [dict(row) for row in cursor.fetchall()] if cursor.description else []
+        return {
+            "success": True,
+            "results": rows,
+            "meta": {
+                "changes": self._conn.total_changes - changes_before,
+                "last_row_id": cursor.lastrowid,
+                "duration": (time.perf_counter() - started) * 1000,
+            },
+        }
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # Every plugin call opens a fresh connection; the default backlog of 5
+    # would turn bursts of concurrent requests into connect timeouts.
+    request_queue_size = 1024
+
+
+def _handler(standin: D1StandIn):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            if not _QUERY_PATH.match(self.path):
+                return self._reply(404, {"success": False, "errors": [{"code": 7003, "message": "Not found"}]})
+            length = int(self.headers.get("Content-Length", 0))
+            try:
+                body = json.loads(self.rfile.read(length))
+            except json.JSONDecodeError as e:
+                return self._reply(400, {"success": False, "errors": [{"code": 7400, "message": str(e)}]})
+            payload = standin.execute(body)
+            self._reply(200 if payload["success"] else 400, payload)
+
+        def _reply(self, status: int, payload: Dict[str, Any]) -> None:
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(
+    path: str, host: str = "127.0.0.1", port: int = 0, latency_ms: float = 0.0
+) -> "tuple[ThreadingHTTPServer, str]":
+    """
+    Start the stand-in on a background thread.
+
+    Returns:
+        (server, base_url). base_url is the value for CLOUDFLARE_API_BASE_URL.
+        Call server.shutdown() to stop it.
+    """
+    standin = D1StandIn(path, latency_ms=latency_ms)
+    server = _Server((host, port), _handler(standin))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/client/v4"
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Local Cloudflare D1 stand-in backed by SQLite")
+    parser.add_argument("--db", default="d1_standin.sqlite3", help="SQLite database file")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8787)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="simulated network latency per request")
+    args = parser.parse_args(argv)
+
+    server = _Server((args.host, args.port), _handler(D1StandIn(args.db, args.latency_ms)))
+    print(f"CLOUDFLARE_API_BASE_URL=http://{args.host}:{args.port}/client/v4")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,330 @@
+"""
+Concurrent load test for the Store Message and Load Conversation tools.
+
+Replays a conversation trace against PutMessageTool and GetConversationTool
+through their normal Dify entry point, with a thread pool or an asyncio
+driver, against the local D1 stand-in (or any D1-compatible URL). Reports
+throughput, latency percentiles and errors, then reads every conversation
+back and counts lost and duplicated messages. Exits with status 1 when a
+threshold is missed, so it can gate CI runs.
+
+A trace is a JSONL file of events, replayed in file order:
+
+    {"op": "get", "conversation_id": "c1", "user_input": "hi"}
+    {"op": "put", "conversation_id": "c1", "role": "user", "text": "hi"}
+
+Without --trace a synthetic one is generated: every turn reads the history
+and then stores a user and an assistant message, with turns of different
+conversations randomly interleaved. Fewer conversations than --concurrency
+means many appends racing on the same conversation.
+
+Run from the plugin root:
+
+    python -m benchmarks.load_test --mode thread --concurrency 64 --conversations 16 --turns 20
+"""
+# Import the SDK first: it monkey-patches the stdlib with gevent, exactly as
+# in the plugin runtime, and must do so before ssl and threading are used.
+import dify_plugin  # noqa: F401
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Optional, List, Dict, Any
+
+from benchmarks.d1_standin import serve
+from tools.get_conversation import GetConversationTool
+from tools.put_message import PutMessageTool
+from utils.connector import cloudflare_d1_query, cloudflare_d1_result_success
+from utils.core import initialize_database
+
+CREDENTIALS = {
+    "cloudflare_account_id": "load-test-account",
+    "cloudflare_d1_database_id": "load-test-database",
+    "cloudflare_api_token": "load-test-token",
+}
+DB_METADATA = {
+    "account_id": CREDENTIALS["cloudflare_account_id"],
+    "database_id": CREDENTIALS["cloudflare_d1_database_id"],
+    "api_token": CREDENTIALS["cloudflare_api_token"],
+}
+
+
+@dataclass
+class TraceEvent:
+    op: str
+    conversation_id: str
+    role: Optional[str] = None
+    text: Optional[str] = None
+    user_input: Optional[str] = None
+
+
+@dataclass
+class Outcome:
+    op: str
+    latency: float
+    ok: bool
+    error: Optional[str] = None
+
+
+def load_trace(path: str) -> List[TraceEvent]:
+    with open(path, encoding="utf-8") as f:
+        return [TraceEvent(**json.loads(line)) for line in f if line.strip()]
+
+
+def synthetic_trace(conversations: int, turns: int, reads_per_turn: int, seed: int) -> List[TraceEvent]:
+    rng = random.Random(seed)
+    streams = []
+    for c in range(conversations):
+        conversation_id = f"conversation-{c}"
+        events = []
+        for t in range(turns):
+            question = f"question {t} of {conversation_id}: " + "lorem ipsum " * rng.randint(1, 30)
+            answer = f"answer {t} of {conversation_id}: " + "dolor sit amet " * rng.randint(5, 120)
+            for _ in range(reads_per_turn):
+                events.append(TraceEvent("get", conversation_id, user_input=question))
+            events.append(TraceEvent("put", conversation_id, role="user", text=question))
+            events.append(TraceEvent("put", conversation_id, role="assistant", text=answer))
+        streams.append(events)
+
+    # Interleave the streams at random while keeping each one in order.
+    trace = []
+    positions = [0] * len(streams)
+    remaining = [i for i, s in enumerate(streams) if s]
+    while remaining:
+        i = rng.choice(remaining)
+        trace.append(streams[i][positions[i]])
+        positions[i] += 1
+        if positions[i] == len(streams[i]):
+            remaining.remove(i)
+    return trace
+
+
+def _tool_options(args: argparse.Namespace) -> Dict[str, Any]:
+    if not args.local_replica:
+        return {}
+    return {"local_replica": True, "replica_max_staleness": args.replica_max_staleness}
+
+
+def execute(event: TraceEvent, run_id: str, options: Dict[str, Any]) -> Outcome:
+    conversation_id = f"{run_id}-{event.conversation_id}"
+    started = time.perf_counter()
+    try:
+        if event.op == "put":
+            tool = PutMessageTool.from_credentials(CREDENTIALS)
+            params = {"conversation_id": conversation_id, "role": event.role, "text": event.text}
+            messages = list(tool.invoke({**params, **options}))
+            variables = {
+                m.message.variable_name: m.message.variable_value
+                for m in messages
+                if hasattr(m.message, "variable_name")
+            }
+            if "seq" not in variables:
+                return Outcome("put", time.perf_counter() - started, False, "message was not stored")
+        elif event.op == "get":
+            tool = GetConversationTool.from_credentials(CREDENTIALS)
+            params = {
+                "conversation_id": conversation_id,
+                "user_input": event.user_input,
+                "format": "xml",
+                "max_round": 50,
+            }
+            list(tool.invoke({**params, **options}))
+        else:
+            raise ValueError(f"Unknown trace op: {event.op}")
+    except Exception as e:
+        return Outcome(event.op, time.perf_counter() - started, False, f"{type(e).__name__}: {e}")
+    return Outcome(event.op, time.perf_counter() - started, True)
+
+
+def run_threads(events: List[TraceEvent], concurrency: int, run_id: str, options: Dict[str, Any]) -> List[Outcome]:
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(lambda e: execute(e, run_id, options), events))
+
+
+def run_asyncio(events: List[TraceEvent], concurrency: int, run_id: str, options: Dict[str, Any]) -> List[Outcome]:
+    async def main() -> List[Outcome]:
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(concurrency)
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+
+            async def one(event: TraceEvent) -> Outcome:
+                async with semaphore:
+                    return await loop.run_in_executor(pool, execute, event, run_id, options)
+
+            return await asyncio.gather(*(one(e) for e in events))
+
+    return asyncio.run(main())
+
+
+def verify(events: List[TraceEvent], run_id: str) -> Dict[str, int]:
+    """Compare the messages the trace stored with what the database holds."""
+    expected: Counter = Counter(
+        (f"{run_id}-{e.conversation_id}", e.role, e.text) for e in events if e.op == "put"
+    )
+    stored: Counter = Counter()
+    seq_collisions = 0
+    for conversation_id in sorted({key[0] for key in expected}):
+        result = cloudflare_d1_query(
+            account_id=DB_METADATA["account_id"],
+            database_id=DB_METADATA["database_id"],
+            api_token=DB_METADATA["api_token"],
+            sql_query="SELECT role, text, seq FROM Message WHERE conversation_id = ?;",
+            params=json.dumps([conversation_id]),
+        )
+        if not cloudflare_d1_result_success(result):
+            raise RuntimeError(f"Verification query failed: {result}")
+        rows = result["metadata"]["result"][0]["results"]
+        stored.update((conversation_id, row["role"], row["text"]) for row in rows)
+        seqs = [row["seq"] for row in rows]
+        seq_collisions += len(seqs) - len(set(seqs))
+    return {
+        "expected": sum(expected.values()),
+        "stored": sum(stored.values()),
+        "lost": sum((expected - stored).values()),
+        "duplicated": sum((stored - expected).values()),
+        "seq_collisions": seq_collisions,
+    }
+
+
+def _percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(outcomes: List[Outcome], elapsed: float) -> Dict[str, Any]:
+    summary: Dict[str, Any] = {
+        "operations": len(outcomes),
+        "elapsed_seconds": elapsed,
+        "throughput": len(outcomes) / elapsed if elapsed else 0.0,
+        "errors": sum(not o.ok for o in outcomes),
+        "by_op": {},
+    }
+    summary["error_rate"] = summary["errors"] / len(outcomes) if outcomes else 0.0
+    for op in sorted({o.op for o in outcomes}):
+        latencies = sorted(o.latency * 1000 for o in outcomes if o.op == op)
+        summary["by_op"][op] = {
+            "count": len(latencies),
+            "errors": sum(not o.ok for o in outcomes if o.op == op),
+            "p50_ms": _percentile(latencies, 0.50),
+            "p90_ms": _percentile(latencies, 0.90),
+            "p99_ms": _percentile(latencies, 0.99),
+            "max_ms": latencies[-1],
+        }
+    summary["sample_errors"] = sorted({o.error for o in outcomes if o.error})[:5]
+    return summary
+
+
+def check_thresholds(summary: Dict[str, Any], args: argparse.Namespace) -> List[str]:
+    failures = []
+    if args.min_throughput is not None and summary["throughput"] < args.min_throughput:
+        failures.append(f"throughput {summary['throughput']:.1f} ops/s < {args.min_throughput}")
+    if args.max_p99_ms is not None:
+        for op, stats in summary["by_op"].items():
+            if stats["p99_ms"] > args.max_p99_ms:
+                failures.append(f"{op} p99 {stats['p99_ms']:.1f} ms > {args.max_p99_ms}")
+    if summary["error_rate"] > args.max_error_rate:
+        failures.append(f"error rate {summary['error_rate']:.2%} > {args.max_error_rate:.2%}")
+    verification = summary.get("verification")
+    if verification:
+        if verification["lost"] > args.max_lost:
+            failures.append(f"{verification['lost']} lost messages > {args.max_lost}")
+        if verification["duplicated"] > args.max_duplicated:
+            failures.append(f"{verification['duplicated']} duplicated messages > {args.max_duplicated}")
+        if verification["seq_collisions"]:
+            failures.append(f"{verification['seq_collisions']} duplicated seq values")
+    return failures
+
+
+def print_summary(summary: Dict[str, Any]) -> None:
+    print(
+        f"{summary['operations']} operations in {summary['elapsed_seconds']:.2f}s, "
+        f"{summary['throughput']:.1f} ops/s, {summary['errors']} errors ({summary['error_rate']:.2%})"
+    )
+    print(f"{'op':6}{'count':>8}{'errors':>8}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for op, s in summary["by_op"].items():
+        print(
+            f"{op:6}{s['count']:>8}{s['errors']:>8}{s['p50_ms']:>10.1f}{s['p90_ms']:>10.1f}"
+            f"{s['p99_ms']:>10.1f}{s['max_ms']:>10.1f}"
+        )
+    if "verification" in summary:
+        v = summary["verification"]
+        print(
+            f"messages: {v['expected']} expected, {v['stored']} stored, {v['lost']} lost, "
+            f"{v['duplicated']} duplicated, {v['seq_collisions']} seq collisions"
+        )
+    for error in summary["sample_errors"]:
+        print(f"error: {error}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Concurrent load test for the conversation memory tools")
+    parser.add_argument("--mode", choices=["thread", "asyncio"], default="thread")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--trace", help="JSONL trace to replay instead of a synthetic one")
+    parser.add_argument("--conversations", type=int, default=16, help="synthetic trace: conversations")
+    parser.add_argument("--turns", type=int, default=10, help="synthetic trace: turns per conversation")
+    parser.add_argument("--reads-per-turn", type=int, default=1, help="synthetic trace: history reads per turn")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--d1-url", help="D1-compatible API base URL; default starts a local stand-in")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="simulated latency of the local stand-in")
+    parser.add_argument("--local-replica", action="store_true", help="enable the tools' local replica")
+    parser.add_argument("--replica-max-staleness", type=float, default=5.0)
+    parser.add_argument("--min-throughput", type=float, help="fail below this many ops/s")
+    parser.add_argument("--max-p99-ms", type=float, help="fail if any op's p99 latency is above this")
+    parser.add_argument("--max-error-rate", type=float, default=0.0)
+    parser.add_argument("--max-lost", type=int, default=0)
+    parser.add_argument("--max-duplicated", type=int, default=0)
+    parser.add_argument("--json-out", help="also write the summary to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        server = None
+        if args.d1_url:
+            os.environ["CLOUDFLARE_API_BASE_URL"] = args.d1_url
+        else:
+            server, base_url = serve(os.path.join(directory, "d1.sqlite3"), latency_ms=args.latency_ms)
+            os.environ["CLOUDFLARE_API_BASE_URL"] = base_url
+        try:
+            init = initialize_database("cloudflare_d1_lite", DB_METADATA)
+            if not cloudflare_d1_result_success(init["message"]):
+                raise SystemExit(f"Could not initialize the database: {init}")
+
+            if args.trace:
+                events = load_trace(args.trace)
+            else:
+                events = synthetic_trace(args.conversations, args.turns, args.reads_per_turn, args.seed)
+            run_id = f"load-{uuid.uuid4().hex[:8]}"
+            runner = run_threads if args.mode == "thread" else run_asyncio
+
+            started = time.perf_counter()
+            outcomes = runner(events, args.concurrency, run_id, _tool_options(args))
+            summary = summarize(outcomes, time.perf_counter() - started)
+            summary["config"] = {k: v for k, v in vars(args).items() if k != "json_out"}
+            summary["verification"] = verify(events, run_id)
+        finally:
+            if server is not None:
+                server.shutdown()
+
+    print_summary(summary)
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+
+    failures = check_thresholds(summary, args)
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    raise SystemExit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,14 @@
 from collections.abc import Generator
 from typing import Any
-import json
 
 from utils.core import (
-    conversation_storage_get_conv_xml_basic,
-    conversation_storage_get_conv_json_basic
+    RENDER_FORMATS,
+    conversation_storage_get_conversation,
+    default_replica_path,
+    dumps_json,
+    history_json_list,
+    message_pairs,
+    render_history_text,
 )
 
 from dify_plugin import Tool
@@ -18,44 +22,37 @@ class GetConversationTool(Tool):
             "database_id": self.runtime.credentials["cloudflare_d1_database_id"],
             "api_token": self.runtime.credentials["cloudflare_api_token"],
         }
+        if tool_parameters.get("local_replica"):
+            db_metadata["replica_path"] = default_replica_path(
+                db_metadata["account_id"], db_metadata["database_id"], db_metadata["api_token"]
+            )
+            db_metadata["replica_max_staleness"] = tool_parameters.get("replica_max_staleness", 5)
         conversation_id = tool_parameters["conversation_id"]
         max_round = tool_parameters.get("max_round", 50)
         user_input = tool_parameters.get("user_input")
         output_format = tool_parameters.get("format", "xml")
-        
-        if output_format == "xml":
-            content = conversation_storage_get_conv_xml_basic(
-                db_brand=db_brand,
-                db_metadata=db_metadata,
-                conversation_id=conversation_id,
-                max_round=max_round,
-            )
-            content = f"<history>\n{content}\n</history>"
-            
-            if user_input:
-                user_message_xml = f"""<latest><message>
-    <role>user</role>
-    <content>{user_input}</content>
-</message></latest>"""
-                content = f"{content}\n{user_message_xml}"
-            # print(content)
-            yield self.create_text_message(content)
-            
-        elif output_format == "json":
-            messages = conversation_storage_get_conv_json_basic(
-                db_brand=db_brand,
-                db_metadata=db_metadata,
-                conversation_id=conversation_id,
-                max_round=max_round,
-            )
-            
-            if user_input:
-                messages.append({"role": "user", "content": user_input})
-            
-            # 返回字符串格式的JSON
-            yield self.create_text_message(json.dumps(messages, ensure_ascii=False))
-            # 返回原生JSON格式
-            yield self.create_json_message({"conversation": messages})
-            
+        if output_format not in RENDER_FORMATS:
+            raise ValueError(f"Unsupported format: {output_format}, only {', '.join(RENDER_FORMATS)} are supported")
+
+        conversation = conversation_storage_get_conversation(
+            db_brand=db_brand,
+            db_metadata=db_metadata,
+            conversation_id=conversation_id,
+            max_round=max_round,
+        )
+        messages = message_pairs(conversation)
+
+        if output_format == "json":
+            # 只序列化一次：文本输出和原生JSON输出共用同一个列表
+            history = history_json_list(messages, user_input)
+            yield self.create_text_message(dumps_json(history))
+            yield self.create_json_message({"conversation": history})
         else:
-            raise ValueError(f"Unsupported format: {output_format}, only 'xml' and 'json' are supported")
+            yield self.create_text_message(
+                render_history_text(
+                    messages,
+                    output_format,
+                    user_input=user_input,
+                    not_found=conversation is None,
+                )
+            )
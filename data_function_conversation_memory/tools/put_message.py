@@ -1,7 +1,7 @@
 from collections.abc import Generator
 from typing import Any
 
-from utils.core import conversation_storage_put_message
+from utils.core import conversation_storage_put_message, default_replica_path
 
 from dify_plugin import Tool
 from dify_plugin.entities.tool import ToolInvokeMessage
@@ -16,6 +16,11 @@ class PutMessageTool(Tool):
             "database_id": self.runtime.credentials["cloudflare_d1_database_id"],
             "api_token": self.runtime.credentials["cloudflare_api_token"],
         }
+        if tool_parameters.get("local_replica"):
+            db_metadata["replica_path"] = default_replica_path(
+                db_metadata["account_id"], db_metadata["database_id"], db_metadata["api_token"]
+            )
+            db_metadata["replica_max_staleness"] = tool_parameters.get("replica_max_staleness", 5)
         role = tool_parameters["role"]
         text = tool_parameters["text"]
         put_msg = conversation_storage_put_message(
@@ -32,3 +37,6 @@ class PutMessageTool(Tool):
         yield self.create_json_message(put_msg)
         yield self.create_variable_message("message_id", message_id)
         yield self.create_variable_message("conversation_id", conversation_id)
+        yield self.create_variable_message("seq", put_msg["seq"])
+        if put_msg["parent_message_id"] is not None:
+            yield self.create_variable_message("parent_message_id", put_msg["parent_message_id"])
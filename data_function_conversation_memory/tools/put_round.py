@@ -0,0 +1,50 @@
+from collections.abc import Generator
+from typing import Any
+import json
+
+from utils.core import conversation_storage_put_messages, default_replica_path
+
+from dify_plugin import Tool
+from dify_plugin.entities.tool import ToolInvokeMessage
+
+class PutRoundTool(Tool):
+    def _invoke(self, tool_parameters: dict[str, Any]) -> Generator[ToolInvokeMessage]:
+        db_brand = "cloudflare_d1_lite"
+        db_metadata = {
+            "account_id": self.runtime.credentials["cloudflare_account_id"],
+            "database_id": self.runtime.credentials["cloudflare_d1_database_id"],
+            "api_token": self.runtime.credentials["cloudflare_api_token"],
+        }
+        if tool_parameters.get("local_replica"):
+            db_metadata["replica_path"] = default_replica_path(
+                db_metadata["account_id"], db_metadata["database_id"], db_metadata["api_token"]
+            )
+            db_metadata["replica_max_staleness"] = tool_parameters.get("replica_max_staleness", 5)
+
+        # Either a JSON list of messages, or the usual user/assistant pair.
+        if tool_parameters.get("messages"):
+            messages = json.loads(tool_parameters["messages"])
+        else:
+            messages = []
+            if tool_parameters.get("user_text"):
+                messages.append({"role": "user", "text": tool_parameters["user_text"]})
+            if tool_parameters.get("assistant_text"):
+                messages.append({"role": "assistant", "text": tool_parameters["assistant_text"]})
+
+        put_round = conversation_storage_put_messages(
+            db_brand=db_brand,
+            db_metadata=db_metadata,
+            conversation_id=tool_parameters["conversation_id"],
+            messages=messages,
+        )
+
+        message_ids = [m["message_id"] for m in put_round["messages"]]
+
+        yield self.create_json_message(put_round)
+        yield self.create_variable_message("conversation_id", put_round["conversation_id"])
+        yield self.create_variable_message("message_ids", message_ids)
+        yield self.create_variable_message("last_message_id", message_ids[-1])
+        for m in put_round["messages"]:
+            if m["role"] in ("user", "assistant"):
+                # With several messages of one role, the last one wins.
+                yield self.create_variable_message(f"{m['role']}_message_id", m["message_id"])
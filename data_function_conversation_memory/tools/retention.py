@@ -0,0 +1,44 @@
+from collections.abc import Generator
+from typing import Any
+import json
+
+from utils.core import conversation_storage_retention
+
+from dify_plugin import Tool
+from dify_plugin.entities.tool import ToolInvokeMessage
+
+# Pause between chunks when the caller does not set one, so a retention run
+# leaves room for the conversation reads and writes sharing the database.
+DEFAULT_PAUSE_SECONDS = 0.5
+
+class RetentionTool(Tool):
+    def _invoke(self, tool_parameters: dict[str, Any]) -> Generator[ToolInvokeMessage]:
+        db_brand = "cloudflare_d1_lite"
+        db_metadata = {
+            "account_id": self.runtime.credentials["cloudflare_account_id"],
+            "database_id": self.runtime.credentials["cloudflare_d1_database_id"],
+            "api_token": self.runtime.credentials["cloudflare_api_token"],
+        }
+        policies = json.loads(tool_parameters["policies"])
+        if isinstance(policies, dict):
+            policies = [policies]
+        cursor = tool_parameters.get("cursor")
+        max_chunks = tool_parameters.get("max_chunks")
+        pause_seconds = tool_parameters.get("pause_seconds")
+
+        report = conversation_storage_retention(
+            db_brand=db_brand,
+            db_metadata=db_metadata,
+            policies=policies,
+            dry_run=bool(tool_parameters.get("dry_run", False)),
+            chunk_size=int(tool_parameters.get("chunk_size") or 50),
+            max_chunks=int(max_chunks) if max_chunks else None,
+            cursor=json.loads(cursor) if cursor else None,
+            pause_seconds=float(pause_seconds) if pause_seconds is not None else DEFAULT_PAUSE_SECONDS,
+        )
+
+        yield self.create_json_message(report)
+        yield self.create_variable_message("completed", report["completed"])
+        yield self.create_variable_message(
+            "cursor", json.dumps(report["cursor"]) if report["cursor"] else ""
+        )
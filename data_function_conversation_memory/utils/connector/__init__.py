@@ -1,3 +1,13 @@
-from .cloudflare_d1_lite import d1_executor, cloudflare_d1_query
+from .cloudflare_d1_lite import (
+    d1_executor,
+    cloudflare_d1_query,
+    cloudflare_d1_batch,
+    cloudflare_d1_result_success,
+)
 
-__all__ = ["d1_executor", "cloudflare_d1_query"]
+__all__ = [
+    "d1_executor",
+    "cloudflare_d1_query",
+    "cloudflare_d1_batch",
+    "cloudflare_d1_result_success",
+]
@@ -1,9 +1,17 @@
 import httpx
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
 import json
 import os
 
 
+def _api_base_url() -> str:
+    """
+    Cloudflare API base URL. CLOUDFLARE_API_BASE_URL overrides it, e.g. to point
+    the plugin at a local D1 stand-in (benchmarks/d1_standin.py) for load tests.
+    """
+    return os.getenv("CLOUDFLARE_API_BASE_URL", "https://api.cloudflare.com/client/v4").rstrip("/")
+
+
 def d1_executor(sql_query: str, params: Optional[str] = None) -> Dict[str, Any]:
     """
     Execute a SQL query on the Cloudflare D1 database using environment variables.
@@ -74,7 +82,6 @@ def cloudflare_d1_query(
         return {"error": "invalid_parameter", "metadata": "sql_query cannot be empty"}
 
     query_params: List[Any] = []
-    print("params:",params)
     if params:
         try:
             query_params = json.loads(params)
@@ -89,7 +96,7 @@ def cloudflare_d1_query(
                 "metadata": f"params is not a valid JSON string: {str(e)}",
             }
 
-    url = f"https://api.cloudflare.com/client/v4/accounts/{account_id}/d1/database/{database_id}/query"
+    url = f"{_api_base_url()}/accounts/{account_id}/d1/database/{database_id}/query"
     headers = {
         "Content-Type": "application/json",
         "Authorization": f"Bearer {api_token}",
@@ -100,7 +107,7 @@ def cloudflare_d1_query(
         response.raise_for_status()
         return {"success": True, "metadata": response.json()}
 
-    except httpx.HTTPError as e:  # Simplified HTTPError handling
+    except httpx.HTTPStatusError as e:
         try:
             error_data = e.response.json()  # Attempt to get JSON, even if it fails
         except json.JSONDecodeError:
@@ -116,6 +123,99 @@ def cloudflare_d1_query(
                 "response_payload": error_data,
             },
         }
+    except httpx.TransportError as e:
+        # Connect/read failures and timeouts have no response to report.
+        return {
+            "error": "http_request_error",
+            "metadata": {"http_status": None, "detail": f"{type(e).__name__}: {e}"},
+        }
+    except json.JSONDecodeError as e:
+        return {"error": "json_decode_error", "metadata": str(e)}
+    except Exception as e:
+        return {"error": "other_error", "metadata": str(e)}
+
+
+def cloudflare_d1_batch(
+    account_id: str,
+    database_id: str,
+    api_token: str,
+    statements: List[Tuple[str, Optional[str]]],
+) -> Dict[str, Any]:
+    """
+    Execute several statements on the Cloudflare D1 database in one request.
+
+    D1 runs a batch as a single transaction: either every statement is applied
+    or none is, and the whole batch costs one HTTP round trip.
+
+    Args:
+        account_id: Cloudflare account ID
+        database_id: D1 database ID
+        api_token: Cloudflare API Bearer Token
+        statements: List of (sql_query, params) tuples, executed in order.
+                    params follows the same stringified JSON array convention
+                    as cloudflare_d1_query, None or empty string for no params.
+
+    Returns:
+        Dict containing query results, same shape as cloudflare_d1_query.
+        metadata["result"] holds one entry per statement, in order.
+    """
+    if not account_id:
+        return {"error": "invalid_parameter", "metadata": "account_id cannot be empty"}
+    if not database_id:
+        return {"error": "invalid_parameter", "metadata": "database_id cannot be empty"}
+    if not statements:
+        return {"error": "invalid_parameter", "metadata": "statements cannot be empty"}
+
+    batch: List[Dict[str, Any]] = []
+    for sql_query, params in statements:
+        if not sql_query:
+            return {"error": "invalid_parameter", "metadata": "sql_query cannot be empty"}
+        query_params: List[Any] = []
+        if params:
+            try:
+                query_params = json.loads(params)
+            except json.JSONDecodeError as e:
+                return {
+                    "error": "invalid_parameter",
+                    "metadata": f"params is not a valid JSON string: {str(e)}",
+                }
+            if not isinstance(query_params, list):
+                return {
+                    "error": "invalid_parameter",
+                    "metadata": 'params must be a JSON array string, e.g., \'["value1", "value2"]\'',
+                }
+        batch.append({"sql": sql_query, "params": query_params})
+
+    url = f"{_api_base_url()}/accounts/{account_id}/d1/database/{database_id}/query"
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {api_token}",
+    }
+    try:
+        response = httpx.post(url, headers=headers, json={"batch": batch})
+        response.raise_for_status()
+        return {"success": True, "metadata": response.json()}
+
+    except httpx.HTTPStatusError as e:
+        try:
+            error_data = e.response.json()
+        except json.JSONDecodeError:
+            error_data = {"response_text": e.response.text}
+
+        return {
+            "error": "http_request_error",
+            "metadata": {
+                "http_status": e.response.status_code,
+                "detail": str(e),
+                "response_payload": error_data,
+            },
+        }
+    except httpx.TransportError as e:
+        # Connect/read failures and timeouts have no response to report.
+        return {
+            "error": "http_request_error",
+            "metadata": {"http_status": None, "detail": f"{type(e).__name__}: {e}"},
+        }
     except json.JSONDecodeError as e:
         return {"error": "json_decode_error", "metadata": str(e)}
     except Exception as e:
@@ -1,19 +1,68 @@
-from .conversation_storage_get_conversation import conversation_storage_get_conversation
+from .conversation_storage_get_conversation import (
+    conversation_storage_get_conversation,
+    conversation_storage_get_conversation_async,
+    forget_conversation_reads,
+)
 from .conversation_storage_init_create_tables import (
+    CONVERSATION_TABLE_SQL,
+    MESSAGE_TABLE_SQL,
     conversation_storage_init_create_tables,
     create_message_table,
+    create_indexes,
+    migrate_message_seq,
+    migrate_conversation_last_seq,
     initialize_database,
+    ensure_schema,
 )
 from .conversation_storage_put_message import conversation_storage_put_message
+from .conversation_storage_put_messages import conversation_storage_put_messages
 from .conversation_storage_get_conv_xml_basic import conversation_storage_get_conv_xml_basic
 from .conversation_storage_get_conv_json_basic import conversation_storage_get_conv_json_basic
+from .conversation_storage_ids import new_id, uuid7
+from .conversation_storage_migrate_ids import conversation_storage_migrate_message_ids
+from .conversation_storage_replica import LocalReplica, get_replica, default_replica_path, credential_tag
+from .conversation_storage_retention import RetentionPolicy, conversation_storage_retention
+from .conversation_storage_single_flight import SingleFlight
+from .conversation_storage_render import (
+    RENDER_FORMATS,
+    dumps_json,
+    message_pairs,
+    render_history,
+    render_history_text,
+    history_json_list,
+)
 
 __all__ = [
+    "CONVERSATION_TABLE_SQL",
+    "MESSAGE_TABLE_SQL",
     "conversation_storage_init_create_tables",
     "create_message_table",
+    "create_indexes",
+    "migrate_message_seq",
+    "migrate_conversation_last_seq",
     "initialize_database",
+    "ensure_schema",
     "conversation_storage_get_conversation",
+    "conversation_storage_get_conversation_async",
+    "forget_conversation_reads",
     "conversation_storage_get_conv_xml_basic",
     "conversation_storage_get_conv_json_basic",
     "conversation_storage_put_message",
+    "conversation_storage_put_messages",
+    "new_id",
+    "uuid7",
+    "conversation_storage_migrate_message_ids",
+    "LocalReplica",
+    "get_replica",
+    "default_replica_path",
+    "credential_tag",
+    "RetentionPolicy",
+    "conversation_storage_retention",
+    "SingleFlight",
+    "RENDER_FORMATS",
+    "dumps_json",
+    "message_pairs",
+    "render_history",
+    "render_history_text",
+    "history_json_list",
 ]
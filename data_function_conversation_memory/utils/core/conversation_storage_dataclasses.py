@@ -1,7 +1,8 @@
 from dataclasses import dataclass, field
 from datetime import datetime
 from typing import Optional, Dict, Any
-import uuid
+
+from .conversation_storage_ids import new_id
 
 
 @dataclass
@@ -11,7 +12,7 @@ class Conversation:
 
     Attributes:
         conversation_id (str): 对话ID，作为唯一标识符 (主键).  类型为 TEXT 在数据库中。
-                                 如果未提供，则自动生成 UUID。
+                                 如果未提供，则自动生成按时间排序的 UUIDv7 (见 conversation_storage_ids)。
         project (Optional[str]): 项目标识符，用于区分不同项目的对话。 类型为 TEXT 在数据库中。
                                  可选字段。
         brand (Optional[str]): 品牌标识符，用于进一步区分，例如区分 Dify 或其他品牌。 类型为 TEXT 在数据库中。
@@ -29,9 +30,11 @@ class Conversation:
                                             类型为 TEXT 在数据库中，以 JSON 格式存储。
                                             这是一个灵活的字段，具体用途由开发者根据实际需求定义。
                                             例如，可以存储对话的摘要、用户偏好、会话标签、使用的模型配置等。
+        last_seq (int): 对话中已分配的最大消息序号 (见 Message.seq)，默认为 0。 类型为 INTEGER 在数据库中，非空约束。
+                        每追加一条消息时在同一事务中加一，删除消息不会使其回退，因此 seq 始终单调递增。
     """
 
-    conversation_id: str = field(default_factory=lambda: str(uuid.uuid4()))
+    conversation_id: str = field(default_factory=new_id)
     project: Optional[str] = None
     brand: Optional[str] = None
     sequence: str = field(default="sequential")
@@ -39,6 +42,7 @@ class Conversation:
     created_at: datetime = field(default_factory=datetime.now)
     latest_message_id: Optional[str] = None
     metadata: Optional[Dict[str, Any]] = None
+    last_seq: int = 0
 
 
 @dataclass
@@ -52,7 +56,7 @@ class Message:
                     当用户编辑消息时，新的消息角色仍然是 'user'，但会通过 parent_message_id 关联到被编辑的消息。
         text (str): 消息的文本内容，不能为空。 类型为 TEXT 在数据库中，非空约束。
         message_id (str): 消息ID，作为唯一标识符 (主键)。 类型为 TEXT 在数据库中。
-                             如果未提供，则自动生成 UUID。
+                             如果未提供，则自动生成按时间排序的 UUIDv7 (见 conversation_storage_ids)。
         parent_message_id (Optional[str]): 父消息ID，用于表示消息的层级关系，例如回复消息或编辑/重试的消息。 可以为空。
                                         类型为 TEXT 在数据库中，这里使用 Optional[str] 表示可以为空。
                                         关联到 Message 表自身的 message_id (自引用外键关系).
@@ -63,12 +67,18 @@ class Message:
                                             类型为 TEXT 在数据库中，以 JSON 格式存储。
                                             这是一个灵活的字段，具体用途由开发者根据实际需求定义。
                                             例如，可以存储消息的发送/接收状态、tokens 消耗统计、外部引用链接、模型生成参数等。
+        seq (Optional[int]): 消息在所属对话内的序号，从 1 开始单调递增。 类型为 INTEGER 在数据库中。
+                             由数据库在插入时原子分配 (取自 Conversation.last_seq 计数器)，有 (conversation_id, seq) 唯一索引。
+                             删除消息后序号不会被复用。
+                             所有读取路径均按 seq 排序和定位，而不是按 timestamp 字符串比较。
+                             尚未写入数据库的消息为 None。
     """
 
     conversation_id: str
     role: str
     text: str
-    message_id: str = field(default_factory=lambda: str(uuid.uuid4()))
+    message_id: str = field(default_factory=new_id)
     parent_message_id: Optional[str] = None
     timestamp: datetime = field(default_factory=datetime.now)
     metadata: Optional[Dict[str, Any]] = None
+    seq: Optional[int] = None
@@ -1,5 +1,6 @@
 from typing import Dict, Any, Optional, List
 from . import conversation_storage_get_conversation
+from .conversation_storage_render import message_pairs, history_json_list
 
 def conversation_storage_get_conv_json_basic(
     db_brand: str,
@@ -7,6 +8,7 @@ def conversation_storage_get_conv_json_basic(
     conversation_id: str,
     message_id: Optional[str] = "latest",
     max_round: int = 10,
+    before_seq: Optional[int] = None,
 ) -> List[Dict[str, str]]:
     """
     获取对话历史并转换为基础JSON格式
@@ -17,6 +19,7 @@ def conversation_storage_get_conv_json_basic(
         conversation_id: 对话ID
         message_id: 可选的起始消息ID
         max_round: 最大返回的消息轮数
+        before_seq: 可选的分页位置，只返回 seq 小于该值的消息
 
     Returns:
         List[Dict[str, str]]: JSON格式的消息历史
@@ -27,12 +30,7 @@ def conversation_storage_get_conv_json_basic(
         conversation_id=conversation_id,
         message_id=message_id,
         max_round=max_round,
+        before_seq=before_seq,
     )
 
-    if not conversation or not hasattr(conversation, "messages"):
-        return []
-    
-    return [
-        {"role": msg.role, "content": msg.text}
-        for msg in conversation.messages
-    ]
+    return history_json_list(message_pairs(conversation))
@@ -1,5 +1,6 @@
 from typing import Dict, Any, Optional
 from . import conversation_storage_get_conversation
+from .conversation_storage_render import XML_NOT_FOUND, message_pairs, render_history_text
 
 
 def conversation_storage_get_conv_xml_basic(
@@ -8,6 +9,7 @@ def conversation_storage_get_conv_xml_basic(
     conversation_id: str,
     message_id: Optional[str] = "latest",
     max_round: int = 10,
+    before_seq: Optional[int] = None,
 ) -> str:
     """
     获取对话历史并转换为基础XML格式
@@ -18,9 +20,10 @@ def conversation_storage_get_conv_xml_basic(
         conversation_id: 对话ID
         message_id: 可选的起始消息ID
         max_round: 最大返回的消息轮数
+        before_seq: 可选的分页位置，只返回 seq 小于该值的消息
 
     Returns:
-        str: XML格式的消息历史
+        str: XML格式的消息历史，角色和内容均已转义
     """
     conversation = conversation_storage_get_conversation(
         db_brand=db_brand,
@@ -28,16 +31,9 @@ def conversation_storage_get_conv_xml_basic(
         conversation_id=conversation_id,
         message_id=message_id,
         max_round=max_round,
+        before_seq=before_seq,
     )
 
     if not conversation or not hasattr(conversation, "messages"):
-        return "<error>Conversation not found or this is the first message</error>"
-    result = []
-    for msg in conversation.messages:
-        message_xml = f"""<message>
-    <role>{msg.role}</role>
-    <content>{msg.text}</content>
-</message>"""
-        result.append(message_xml)
-
-    return "\n".join(result)
+        return XML_NOT_FOUND
+    return render_history_text(message_pairs(conversation), "xml", wrap=False)
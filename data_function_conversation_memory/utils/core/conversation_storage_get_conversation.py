@@ -1,8 +1,42 @@
-from typing import Optional, List, Dict, Any
+from typing import Optional, Dict, Any
 import json
-from utils.connector import cloudflare_d1_query
-from .conversation_storage_dataclasses import Conversation, Message
-from datetime import datetime
+from utils.connector import cloudflare_d1_query, cloudflare_d1_result_success
+from .conversation_storage_dataclasses import Conversation
+from .conversation_storage_queries import (
+    SQL_SELECT_CONVERSATION,
+    messages_query,
+    conversation_from_row,
+    attach_messages,
+)
+from .conversation_storage_replica import get_replica, credential_tag
+from .conversation_storage_init_create_tables import ensure_schema
+from .conversation_storage_single_flight import SingleFlight
+
+# Concurrent identical reads (same database, token, conversation and window)
+# share one fetch. See conversation_storage_single_flight.
+_history_reads = SingleFlight()
+
+
+def _read_key(db_metadata: Dict[str, Any], conversation_id: str, *window: Any) -> tuple:
+    # Reads with different API tokens must never share a fetch. The token is
+    # hashed so it does not show up in a TimeoutError message.
+    return (
+        db_metadata.get("account_id"),
+        db_metadata.get("database_id"),
+        conversation_id,
+        credential_tag(db_metadata.get("api_token")),
+        db_metadata.get("replica_path"),
+    ) + window
+
+
+def forget_conversation_reads(db_metadata: Dict[str, Any], conversation_id: str) -> int:
+    """
+    Stop later reads of the conversation from joining a fetch that started
+    before a write, so a reader always sees writes that finished before it
+    was called. Reads made with any token or replica are detached.
+    """
+    prefix = _read_key(db_metadata, conversation_id)[:3]
+    return _history_reads.forget(lambda key: key[:3] == prefix)
 
 
 def conversation_storage_get_conversation(
@@ -11,42 +45,102 @@ def conversation_storage_get_conversation(
     conversation_id: str,
     message_id: Optional[str] = "latest",
     max_round: int = 10,
+    before_seq: Optional[int] = None,
 ) -> Optional[Conversation]:
     """
     Retrieve message history for a specific conversation.
 
     Args:
         db_brand: Database brand, should be "cloudflare_d1_lite"
-        db_metadata: Metadata for database connection
+        db_metadata: Metadata for database connection. If it contains "replica_path",
+                     reads are served from the local replica (see conversation_storage_replica).
         conversation_id: Target conversation ID
         message_id: Optional starting message ID. Default 'latest' gets the most recent messages.
                    Can be used to trace history from a specific message.
         max_round: Maximum number of message rounds to return (for lazy loading optimization)
+        before_seq: Optional seq to page backwards from: returns the max_round messages just
+                    before it, e.g. pass the seq of the oldest message already loaded.
+                    Works the same for 'sequential' and 'tree' conversations.
+
+    Concurrent calls with the same database, conversation and window share a
+    single fetch and receive the same Conversation object, which must not be
+    modified. db_metadata may set "read_timeout" (seconds) to bound the wait;
+    a TimeoutError is raised when it expires.
 
     Returns:
         Conversation object containing message history (Message list).
         Message list structure depends on Conversation sequence type ('sequential' or 'tree').
         Returns None if conversation not found.
+
+    Raises:
+        RuntimeError: A D1 query failed, or the schema could not be migrated (see ensure_schema).
     """
     if db_brand != "cloudflare_d1_lite":
         raise ValueError("Unsupported database brand")
 
+    return _history_reads.do(
+        _read_key(db_metadata, conversation_id, message_id, max_round, before_seq),
+        lambda: _fetch_conversation(db_metadata, conversation_id, max_round, before_seq),
+        timeout=db_metadata.get("read_timeout"),
+    )
+
+
+async def conversation_storage_get_conversation_async(
+    db_brand: str,
+    db_metadata: Dict[str, Any],
+    conversation_id: str,
+    message_id: Optional[str] = "latest",
+    max_round: int = 10,
+    before_seq: Optional[int] = None,
+) -> Optional[Conversation]:
+    """
+    Async variant of conversation_storage_get_conversation.
+    Coalesces with concurrent sync and async reads of the same window.
+    """
+    if db_brand != "cloudflare_d1_lite":
+        raise ValueError("Unsupported database brand")
+
+    return await _history_reads.do_async(
+        _read_key(db_metadata, conversation_id, message_id, max_round, before_seq),
+        lambda: _fetch_conversation(db_metadata, conversation_id, max_round, before_seq),
+        timeout=db_metadata.get("read_timeout"),
+    )
+
+
+def _fetch_conversation(
+    db_metadata: Dict[str, Any],
+    conversation_id: str,
+    max_round: int,
+    before_seq: Optional[int],
+) -> Optional[Conversation]:
+    ensure_schema("cloudflare_d1_lite", db_metadata)
+    replica = get_replica(db_metadata)
+    if replica is not None:
+        served, conversation = replica.read_conversation(
+            db_metadata=db_metadata,
+            conversation_id=conversation_id,
+            max_round=max_round,
+            before_seq=before_seq,
+        )
+        if served:
+            return conversation
+
     account_id = db_metadata.get("account_id")
     database_id = db_metadata.get("database_id")
     api_token = db_metadata.get("api_token")
 
-    sql_conversation = "SELECT * FROM Conversation WHERE conversation_id = ?;"
     conversation_result = cloudflare_d1_query(
         account_id=account_id,
         database_id=database_id,
         api_token=api_token,
-        sql_query=sql_conversation,
+        sql_query=SQL_SELECT_CONVERSATION,
         params=f'["{conversation_id}"]',
     )
 
-    # Extract result from D1 response
-    if not conversation_result.get("success"):
-        return None
+    # Extract result from D1 response. A failed query is an error, not a
+    # missing conversation.
+    if not cloudflare_d1_result_success(conversation_result):
+        raise RuntimeError(f"Failed to read conversation: {conversation_result}")
 
     results = (
         conversation_result.get("metadata", {})
@@ -56,97 +150,27 @@ def conversation_storage_get_conversation(
     if not results:
         return None
 
-    conversation_row = results[0]
-
-    conversation = Conversation(
-        conversation_id=conversation_row["conversation_id"],
-        project=conversation_row["project"],
-        brand=conversation_row["brand"],
-        sequence=conversation_row["sequence"],
-        status=conversation_row["status"],
-        created_at=datetime.fromisoformat(conversation_row["created_at"]),
-        latest_message_id=conversation_row["latest_message_id"],
-        metadata=(
-            json.loads(conversation_row["metadata"])
-            if conversation_row["metadata"]
-            else None
-        ),
-    )
+    conversation = conversation_from_row(results[0])
 
-    message_list: List[Message] = []
-    if conversation.sequence == "sequential":
-        sql_messages = """
-        SELECT * FROM Message
-        WHERE conversation_id = ?
-        ORDER BY timestamp DESC
-        LIMIT ?;
-        """
-        messages_result = cloudflare_d1_query(
-            account_id=account_id,
-            database_id=database_id,
-            api_token=api_token,
-            sql_query=sql_messages,
-            params=f'["{conversation_id}", {max_round}]',
-        )
+    sql_messages = messages_query(conversation, before_seq)
+    if sql_messages is None:
+        return attach_messages(conversation, [])
 
-        print(messages_result)
-        # Extract messages from D1 response
-        if messages_result.get("success"):
-            message_rows = (
-                messages_result.get("metadata", {})
-                .get("result", [{}])[0]
-                .get("results", [])
-            )
-            for row in message_rows:
-                message = Message(
-                    message_id=row["message_id"],
-                    conversation_id=row["conversation_id"],
-                    role=row["role"],
-                    text=row["text"],
-                    parent_message_id=row["parent_message_id"],
-                    timestamp=datetime.fromisoformat(row["timestamp"]),
-                    metadata=json.loads(row["metadata"]) if row["metadata"] else None,
-                )
-                message_list.append(message)
-        conversation.messages = list(reversed(message_list))
-
-    elif conversation.sequence == "tree":
-        sql_messages = """
-        SELECT * FROM Message
-        WHERE conversation_id = ?
-        ORDER BY timestamp ASC
-        LIMIT ?;
-        """
-        messages_result = cloudflare_d1_query(
-            account_id=account_id,
-            database_id=database_id,
-            api_token=api_token,
-            sql_query=sql_messages,
-            params=f'["{conversation_id}", {max_round}]',
-        )
+    messages_result = cloudflare_d1_query(
+        account_id=account_id,
+        database_id=database_id,
+        api_token=api_token,
+        sql_query=sql_messages,
+        params=json.dumps([conversation_id, before_seq, before_seq, max_round]),
+    )
 
-        # Extract messages from D1 response
-        if messages_result.get("success"):
-            message_rows = (
-                messages_result.get("metadata", {})
-                .get("result", [{}])[0]
-                .get("results", [])
-            )
-
-            for row in message_rows:
-                message = Message(
-                    message_id=row["message_id"],
-                    conversation_id=row["conversation_id"],
-                    role=row["role"],
-                    text=row["text"],
-                    parent_message_id=row["parent_message_id"],
-                    timestamp=datetime.fromisoformat(row["timestamp"]),
-                    metadata=json.loads(row["metadata"]) if row["metadata"] else None,
-                )
-                message_list.append(message)
-        conversation.messages = message_list
-
-    else:
-        conversation.messages = []
-
-    return conversation
+    # Extract messages from D1 response. Never hand back an empty history
+    # for a query that failed.
+    if not cloudflare_d1_result_success(messages_result):
+        raise RuntimeError(f"Failed to read messages: {messages_result}")
+    message_rows = (
+        messages_result.get("metadata", {})
+        .get("result", [{}])[0]
+        .get("results", [])
+    )
+    return attach_messages(conversation, message_rows)
@@ -0,0 +1,69 @@
+from datetime import datetime
+from typing import Optional
+import secrets
+import threading
+import time
+import uuid
+
+_lock = threading.Lock()
+_last_ms = 0
+_counter = 0
+
+# rand_a is 12 bits. A fresh millisecond starts the counter somewhere in the
+# lower half so there is always room left to count up within it.
+_COUNTER_MAX = 0xFFF
+_COUNTER_SEED_MAX = 0x7FF
+
+
+def _build_uuid7(unix_ms: int, rand_a: int, rand_b: int) -> uuid.UUID:
+    value = (unix_ms & 0xFFFF_FFFF_FFFF) << 80
+    value |= 0x7 << 76
+    value |= (rand_a & _COUNTER_MAX) << 64
+    value |= 0b10 << 62
+    value |= rand_b & ((1 << 62) - 1)
+    return uuid.UUID(int=value)
+
+
+def uuid7() -> uuid.UUID:
+    """
+    Generate a time-ordered UUIDv7 (RFC 9562).
+
+    The first 48 bits are the Unix time in milliseconds, so IDs generated later
+    sort after earlier ones and new rows land at the right edge of the primary
+    key B-tree instead of at random pages. The 12-bit rand_a field is used as a
+    counter, which keeps IDs from one process strictly increasing even when many
+    are generated in the same millisecond.
+    """
+    global _last_ms, _counter
+    with _lock:
+        now_ms = time.time_ns() // 1_000_000
+        if now_ms > _last_ms:
+            _last_ms = now_ms
+            _counter = secrets.randbelow(_COUNTER_SEED_MAX + 1)
+        else:
+            _counter += 1
+            if _counter > _COUNTER_MAX:
+                # Counter exhausted: borrow the next millisecond.
+                _last_ms += 1
+                _counter = 0
+        unix_ms = _last_ms
+        rand_a = _counter
+    return _build_uuid7(unix_ms, rand_a, secrets.randbits(62))
+
+
+def uuid7_from_datetime(moment: datetime) -> uuid.UUID:
+    """
+    Generate a UUIDv7 for a point in the past, e.g. when migrating existing rows.
+
+    Unlike uuid7() this does not touch the monotonic counter, so IDs created
+    for the same millisecond are ordered randomly among themselves.
+    """
+    unix_ms = int(moment.timestamp() * 1000)
+    return _build_uuid7(unix_ms, secrets.randbits(12), secrets.randbits(62))
+
+
+def new_id(moment: Optional[datetime] = None) -> str:
+    """Return a new time-ordered ID as a string, the form stored in the database."""
+    if moment is not None:
+        return str(uuid7_from_datetime(moment))
+    return str(uuid7())
@@ -1,17 +1,13 @@
-from utils.connector import cloudflare_d1_query
-from typing import Any, Dict
+from utils.connector import (
+    cloudflare_d1_query,
+    cloudflare_d1_batch,
+    cloudflare_d1_result_success,
+)
+from typing import Any, Dict, Set, Tuple
+import threading
 
 
-def conversation_storage_init_create_tables(db_brand: str, db_metadata: Dict[str, Any]) -> Any:
-    """创建 Conversation 表."""
-    if db_brand != "cloudflare_d1_lite":
-        raise ValueError("Unsupported database brand")
-
-    account_id = db_metadata.get("account_id")
-    database_id = db_metadata.get("database_id")
-    api_token = db_metadata.get("api_token")
-
-    sql = """
+CONVERSATION_TABLE_SQL = """
     CREATE TABLE IF NOT EXISTS Conversation (
         conversation_id TEXT PRIMARY KEY NOT NULL,
         project TEXT,
@@ -20,9 +16,37 @@ def conversation_storage_init_create_tables(db_brand: str, db_metadata: Dict[str
         status TEXT NOT NULL DEFAULT 'active',
         created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
         latest_message_id TEXT,
-        metadata TEXT
+        metadata TEXT,
+        last_seq INTEGER NOT NULL DEFAULT 0
     );
     """
+
+MESSAGE_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS Message (
+        message_id TEXT PRIMARY KEY NOT NULL,
+        conversation_id TEXT NOT NULL,
+        role TEXT NOT NULL,
+        text TEXT NOT NULL,
+        parent_message_id TEXT,
+        timestamp DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        metadata TEXT,
+        seq INTEGER,
+        FOREIGN KEY (conversation_id) REFERENCES Conversation(conversation_id) ON DELETE CASCADE,
+        FOREIGN KEY (parent_message_id) REFERENCES Message(message_id) ON DELETE CASCADE
+    );
+    """
+
+
+def conversation_storage_init_create_tables(db_brand: str, db_metadata: Dict[str, Any]) -> Any:
+    """创建 Conversation 表."""
+    if db_brand != "cloudflare_d1_lite":
+        raise ValueError("Unsupported database brand")
+
+    account_id = db_metadata.get("account_id")
+    database_id = db_metadata.get("database_id")
+    api_token = db_metadata.get("api_token")
+
+    sql = CONVERSATION_TABLE_SQL
     result = cloudflare_d1_query(
         account_id=account_id,
         database_id=database_id,
@@ -42,19 +66,7 @@ def create_message_table(db_brand: str, db_metadata: Dict[str, Any]):
     database_id = db_metadata.get("database_id")
     api_token = db_metadata.get("api_token")
 
-    sql = """
-    CREATE TABLE IF NOT EXISTS Message (
-        message_id TEXT PRIMARY KEY NOT NULL,
-        conversation_id TEXT NOT NULL,
-        role TEXT NOT NULL,
-        text TEXT NOT NULL,
-        parent_message_id TEXT,
-        timestamp DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
-        metadata TEXT,
-        FOREIGN KEY (conversation_id) REFERENCES Conversation(conversation_id) ON DELETE CASCADE,
-        FOREIGN KEY (parent_message_id) REFERENCES Message(message_id) ON DELETE CASCADE
-    );
-    """
+    sql = MESSAGE_TABLE_SQL
     result = cloudflare_d1_query(
         account_id=account_id,
         database_id=database_id,
@@ -65,8 +77,217 @@ def create_message_table(db_brand: str, db_metadata: Dict[str, Any]):
     return result
 
 
+def migrate_message_seq(db_brand: str, db_metadata: Dict[str, Any]):
+    """为旧版 Message 表添加 seq 列，并按 timestamp 回填每个对话内的序号。
+
+    在同一个事务中完成加列和回填，避免新写入的消息与回填的序号冲突。
+    seq 列已存在时不做任何操作。
+    """
+    if db_brand != "cloudflare_d1_lite":
+        raise ValueError("Unsupported database brand")
+
+    account_id = db_metadata.get("account_id")
+    database_id = db_metadata.get("database_id")
+    api_token = db_metadata.get("api_token")
+
+    columns_result = cloudflare_d1_query(
+        account_id=account_id,
+        database_id=database_id,
+        api_token=api_token,
+        sql_query="PRAGMA table_info(Message);",
+        params="[]",
+    )
+    if not cloudflare_d1_result_success(columns_result):
+        return columns_result
+    columns = columns_result["metadata"]["result"][0].get("results", [])
+    if any(column["name"] == "seq" for column in columns):
+        return {"success": True, "metadata": "seq column already exists"}
+
+    statements = [
+        ("ALTER TABLE Message ADD COLUMN seq INTEGER;", "[]"),
+        (
+            """
+            UPDATE Message SET seq = ordered.rn
+            FROM (
+                SELECT message_id,
+                       ROW_NUMBER() OVER (
+                           PARTITION BY conversation_id ORDER BY timestamp, message_id
+                       ) AS rn
+                FROM Message
+            ) AS ordered
+            WHERE Message.message_id = ordered.message_id;
+            """,
+            "[]",
+        ),
+    ]
+    result = cloudflare_d1_batch(
+        account_id=account_id,
+        database_id=database_id,
+        api_token=api_token,
+        statements=statements,
+    )
+    return result
+
+
+def migrate_conversation_last_seq(db_brand: str, db_metadata: Dict[str, Any]):
+    """为旧版 Conversation 表添加 last_seq 计数器列，并按现有消息的最大 seq 回填。
+
+    last_seq 记录对话中已分配的最大序号，删除消息 (例如 retention 清理) 不会使其回退。
+    last_seq 列已存在时不做任何操作。需在 migrate_message_seq 之后执行。
+    """
+    if db_brand != "cloudflare_d1_lite":
+        raise ValueError("Unsupported database brand")
+
+    account_id = db_metadata.get("account_id")
+    database_id = db_metadata.get("database_id")
+    api_token = db_metadata.get("api_token")
+
+    columns_result = cloudflare_d1_query(
+        account_id=account_id,
+        database_id=database_id,
+        api_token=api_token,
+        sql_query="PRAGMA table_info(Conversation);",
+        params="[]",
+    )
+    if not cloudflare_d1_result_success(columns_result):
+        return columns_result
+    columns = columns_result["metadata"]["result"][0].get("results", [])
+    if any(column["name"] == "last_seq" for column in columns):
+        return {"success": True, "metadata": "last_seq column already exists"}
+
+    statements = [
+        ("ALTER TABLE Conversation ADD COLUMN last_seq INTEGER NOT NULL DEFAULT 0;", "[]"),
+        (
+            """
+            UPDATE Conversation SET last_seq = IFNULL(
+                (SELECT MAX(m.seq) FROM Message m WHERE m.conversation_id = Conversation.conversation_id), 0
+            );
+            """,
+            "[]",
+        ),
+    ]
+    result = cloudflare_d1_batch(
+        account_id=account_id,
+        database_id=database_id,
+        api_token=api_token,
+        statements=statements,
+    )
+    return result
+
+
+def create_indexes(db_brand: str, db_metadata: Dict[str, Any]):
+    """创建查询和数据保留 (retention) 清理所需的索引。"""
+    if db_brand != "cloudflare_d1_lite":
+        raise ValueError("Unsupported database brand")
+
+    account_id = db_metadata.get("account_id")
+    database_id = db_metadata.get("database_id")
+    api_token = db_metadata.get("api_token")
+
+    statements = [
+        (
+            "CREATE INDEX IF NOT EXISTS idx_message_conversation_timestamp "
+            "ON Message (conversation_id, timestamp);",
+            "[]",
+        ),
+        (
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_message_conversation_seq "
+            "ON Message (conversation_id, seq);",
+            "[]",
+        ),
+        (
+            "CREATE INDEX IF NOT EXISTS idx_message_timestamp "
+            "ON Message (timestamp);",
+            "[]",
+        ),
+        (
+            "CREATE INDEX IF NOT EXISTS idx_message_parent "
+            "ON Message (parent_message_id);",
+            "[]",
+        ),
+        (
+            "CREATE INDEX IF NOT EXISTS idx_conversation_project_brand "
+            "ON Conversation (project, brand);",
+            "[]",
+        ),
+    ]
+    result = cloudflare_d1_batch(
+        account_id=account_id,
+        database_id=database_id,
+        api_token=api_token,
+        statements=statements,
+    )
+    return result
+
+
+# (account_id, database_id) pairs whose schema this process has already
+# verified, so ensure_schema costs one request per database per process.
+_schema_ready: Set[Tuple[str, str]] = set()
+_schema_lock = threading.Lock()
+
+
+def _step_succeeded(outcome: Dict[str, Any]) -> bool:
+    # migrate_* report "already done" as {"success": True, "metadata": "<note>"}.
+    if isinstance(outcome.get("metadata"), str):
+        return bool(outcome.get("success"))
+    return cloudflare_d1_result_success(outcome)
+
+
+def ensure_schema(db_brand: str, db_metadata: Dict[str, Any]) -> None:
+    """确认数据库结构是最新版本，旧版结构在首次使用时自动迁移。
+
+    升级插件后应重新运行 Init 工具；这里作为兜底：检查 Message.seq 和
+    Conversation.last_seq 列，缺失时执行 initialize_database (可重复执行)。
+    每个进程对每个数据库只检查一次。
+
+    Raises:
+        RuntimeError: 无法读取表结构或迁移失败。
+    """
+    if db_brand != "cloudflare_d1_lite":
+        raise ValueError("Unsupported database brand")
+
+    key = (db_metadata.get("account_id"), db_metadata.get("database_id"))
+    if key in _schema_ready:
+        return
+    with _schema_lock:
+        if key in _schema_ready:
+            return
+        result = cloudflare_d1_batch(
+            account_id=db_metadata.get("account_id"),
+            database_id=db_metadata.get("database_id"),
+            api_token=db_metadata.get("api_token"),
+            statements=[
+                ("PRAGMA table_info(Message);", "[]"),
+                ("PRAGMA table_info(Conversation);", "[]"),
+            ],
+        )
+        if not cloudflare_d1_result_success(result):
+            raise RuntimeError(f"Failed to read database schema: {result}")
+        message_columns, conversation_columns = (
+            {column["name"] for column in statement.get("results", [])}
+            for statement in result["metadata"]["result"]
+        )
+        if "seq" not in message_columns or "last_seq" not in conversation_columns:
+            init_result = initialize_database(db_brand, db_metadata)
+            failed = {
+                step: outcome for step, outcome in init_result.items() if not _step_succeeded(outcome)
+            }
+            if failed:
+                raise RuntimeError(f"Database schema migration failed: {failed}")
+        _schema_ready.add(key)
+
+
 def initialize_database(db_brand: str, db_metadata: Dict[str, Any]):
-    """初始化数据库，创建 Conversation 和 Message 表。"""
+    """初始化数据库，创建 Conversation 和 Message 表及其索引。"""
     init_conv = conversation_storage_init_create_tables(db_brand, db_metadata)
     init_msg = create_message_table(db_brand, db_metadata)
-    return {"conversation": init_conv, "message": init_msg}
\ No newline at end of file
+    init_seq = migrate_message_seq(db_brand, db_metadata)
+    init_last_seq = migrate_conversation_last_seq(db_brand, db_metadata)
+    init_idx = create_indexes(db_brand, db_metadata)
+    return {
+        "conversation": init_conv,
+        "message": init_msg,
+        "message_seq": init_seq,
+        "conversation_last_seq": init_last_seq,
+        "indexes": init_idx,
+    }
@@ -0,0 +1,135 @@
+from datetime import datetime
+from typing import Optional, Dict, Any
+import json
+
+from utils.connector import (
+    cloudflare_d1_query,
+    cloudflare_d1_batch,
+    cloudflare_d1_result_success,
+)
+from .conversation_storage_ids import new_id
+
+# Each mapping row binds two parameters and D1 allows 100 per statement.
+MAX_CHUNK_SIZE = 50
+
+
+def conversation_storage_migrate_message_ids(
+    db_brand: str,
+    db_metadata: Dict[str, Any],
+    chunk_size: int = MAX_CHUNK_SIZE,
+    max_chunks: Optional[int] = None,
+    cursor: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Rewrite existing random (UUIDv4) message IDs into time-ordered UUIDv7 IDs.
+
+    This step is optional: old and new IDs can live side by side, and new
+    messages already get UUIDv7 IDs. Rewriting only pays off for large tables
+    whose primary key index is fragmented by old random IDs. The new ID is
+    derived from the message timestamp, and parent_message_id and
+    Conversation.latest_message_id references are rewritten in the same
+    transaction. Message IDs handed out to workflows before the migration stop
+    resolving afterwards, so only run it when nothing keeps them.
+
+    Conversation IDs are not rewritten: they are chosen by the caller.
+
+    Args:
+        db_brand: Database brand, should be "cloudflare_d1_lite"
+        db_metadata: Metadata for database connection
+        chunk_size: Messages rewritten per transaction (capped at MAX_CHUNK_SIZE)
+        max_chunks: Stop after this many chunks and return a cursor. None runs to completion.
+        cursor: Cursor returned by a previous, unfinished run
+
+    Returns:
+        {
+            "migrated": number of message IDs rewritten,
+            "completed": bool,
+            "cursor": None when completed, otherwise the rowid to resume after,
+            "error": present only if a query failed,
+        }
+    """
+    if db_brand != "cloudflare_d1_lite":
+        raise ValueError("Unsupported database brand")
+
+    account_id = db_metadata.get("account_id")
+    database_id = db_metadata.get("database_id")
+    api_token = db_metadata.get("api_token")
+    chunk_size = max(1, min(int(chunk_size), MAX_CHUNK_SIZE))
+
+    # rowid does not change when message_id is updated, so it is a stable
+    # keyset for walking the table once.
+    sql_select = """
+    SELECT rowid AS row_id, message_id, timestamp FROM Message
+    WHERE rowid > ? AND substr(message_id, 15, 1) != '7'
+    ORDER BY rowid
+    LIMIT ?;
+    """
+    report: Dict[str, Any] = {"migrated": 0, "completed": False, "cursor": cursor}
+    after = cursor or 0
+    chunks = 0
+
+    while max_chunks is None or chunks < max_chunks:
+        chunks += 1
+        select_result = cloudflare_d1_query(
+            account_id=account_id,
+            database_id=database_id,
+            api_token=api_token,
+            sql_query=sql_select,
+            params=json.dumps([after, chunk_size]),
+        )
+        if not cloudflare_d1_result_success(select_result):
+            report["error"] = select_result
+            return report
+        rows = select_result["metadata"]["result"][0].get("results", [])
+        if not rows:
+            report["completed"] = True
+            report["cursor"] = None
+            return report
+
+        mapping_params = []
+        for row in rows:
+            mapping_params += [row["message_id"], new_id(datetime.fromisoformat(row["timestamp"]))]
+        mapping = "WITH id_map(old_id, new_id) AS (VALUES " + ", ".join("(?, ?)" for _ in rows) + ") "
+        params = json.dumps(mapping_params)
+        statements = [
+            # Children and the primary key are updated in separate statements,
+            # so the self-referencing foreign key is only checked at commit.
+            ("PRAGMA defer_foreign_keys = on;", "[]"),
+            (
+                mapping + "UPDATE Message SET parent_message_id = "
+                "(SELECT new_id FROM id_map WHERE old_id = Message.parent_message_id) "
+                "WHERE parent_message_id IN (SELECT old_id FROM id_map);",
+                params,
+            ),
+            (
+                mapping + "UPDATE Conversation SET latest_message_id = "
+                "(SELECT new_id FROM id_map WHERE old_id = Conversation.latest_message_id) "
+                "WHERE latest_message_id IN (SELECT old_id FROM id_map);",
+                params,
+            ),
+            (
+                mapping + "UPDATE Message SET message_id = "
+                "(SELECT new_id FROM id_map WHERE old_id = Message.message_id) "
+                "WHERE message_id IN (SELECT old_id FROM id_map);",
+                params,
+            ),
+        ]
+        batch_result = cloudflare_d1_batch(
+            account_id=account_id,
+            database_id=database_id,
+            api_token=api_token,
+            statements=statements,
+        )
+        if not cloudflare_d1_result_success(batch_result):
+            report["error"] = batch_result
+            return report
+
+        report["migrated"] += len(rows)
+        after = rows[-1]["row_id"]
+        report["cursor"] = after
+        if len(rows) < chunk_size:
+            report["completed"] = True
+            report["cursor"] = None
+            return report
+
+    return report
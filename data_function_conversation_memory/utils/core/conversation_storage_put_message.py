@@ -1,9 +1,138 @@
-from typing import Optional, Dict, Any
-import uuid
+from typing import Optional, Dict, Any, List, Tuple
 import json
+import random
+import time
 from datetime import datetime
-from utils.connector import cloudflare_d1_query
+from utils.connector import cloudflare_d1_batch, cloudflare_d1_result_success
 from .conversation_storage_dataclasses import Message, Conversation
+from .conversation_storage_ids import new_id
+from .conversation_storage_replica import get_replica
+from .conversation_storage_init_create_tables import ensure_schema
+from .conversation_storage_get_conversation import forget_conversation_reads
+
+# A failed batch is rolled back as a whole, and retrying it is safe: the
+# message ID is fixed before the first attempt, so a batch that committed but
+# whose response was lost is not inserted twice. Only transport errors and 5xx
+# responses are retried; anything else would fail the same way again.
+MAX_APPEND_ATTEMPTS = 3
+RETRY_BACKOFF_SECONDS = 0.05
+
+SQL_ENSURE_CONVERSATION = """
+    INSERT INTO Conversation (conversation_id, sequence, status, created_at)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT (conversation_id) DO NOTHING;
+    """
+
+# seq comes from the per-conversation counter Conversation.last_seq rather
+# than from the rows still present, so it keeps increasing after retention
+# deletes messages. The counter is only taken for a message that is not stored
+# yet, so retrying a batch does not skip numbers. Taking the MAX with the
+# stored seq keeps it ahead of rows written before the counter existed.
+SQL_TAKE_SEQ = """
+    UPDATE Conversation
+    SET last_seq = MAX(last_seq, IFNULL((SELECT MAX(m.seq) FROM Message m WHERE m.conversation_id = ?), 0)) + 1
+    WHERE conversation_id = ?
+      AND NOT EXISTS (SELECT 1 FROM Message WHERE message_id = ?);
+    """
+
+# parent_message_id defaults to the head read inside the same transaction;
+# seq is the counter value just taken, guarded by the unique
+# (conversation_id, seq) index.
+SQL_APPEND_MESSAGE = """
+    INSERT INTO Message (message_id, conversation_id, role, text, parent_message_id, timestamp, metadata, seq)
+    SELECT ?, c.conversation_id, ?, ?, COALESCE(?, c.latest_message_id), ?, ?, c.last_seq
+    FROM Conversation c
+    WHERE c.conversation_id = ?
+    ON CONFLICT (message_id) DO NOTHING;
+    """
+
+# Compare-and-set on the head: it only moves forward to a message with a
+# higher seq than the current head, so it can never regress to an older one.
+SQL_ADVANCE_HEAD = """
+    UPDATE Conversation
+    SET latest_message_id = ?
+    WHERE conversation_id = ?
+      AND IFNULL((SELECT seq FROM Message WHERE message_id = Conversation.latest_message_id), 0)
+          < (SELECT seq FROM Message WHERE message_id = ?);
+    """
+
+SQL_SELECT_APPENDED = "SELECT seq, parent_message_id FROM Message WHERE message_id = ?;"
+
+
+def append_message_statements(message: Message) -> List[Tuple[str, Optional[str]]]:
+    """
+    Statements that append one message and advance the conversation head.
+
+    The conversation must exist, or be created earlier in the same batch.
+    The last statement returns the stored seq and parent_message_id.
+    """
+    return [
+        (
+            SQL_TAKE_SEQ,
+            json.dumps([message.conversation_id, message.conversation_id, message.message_id]),
+        ),
+        (
+            SQL_APPEND_MESSAGE,
+            json.dumps(
+                [
+                    message.message_id,
+                    message.role,
+                    message.text,
+                    message.parent_message_id,
+                    message.timestamp.isoformat(),
+                    json.dumps(message.metadata) if message.metadata else None,
+                    message.conversation_id,
+                ]
+            ),
+        ),
+        (
+            SQL_ADVANCE_HEAD,
+            json.dumps([message.message_id, message.conversation_id, message.message_id]),
+        ),
+        (SQL_SELECT_APPENDED, json.dumps([message.message_id])),
+    ]
+
+
+def ensure_conversation_statement(conversation: Conversation) -> Tuple[str, Optional[str]]:
+    """Statement that creates the conversation unless it already exists."""
+    return (
+        SQL_ENSURE_CONVERSATION,
+        json.dumps(
+            [
+                conversation.conversation_id,
+                conversation.sequence,
+                conversation.status,
+                conversation.created_at.isoformat(),
+            ]
+        ),
+    )
+
+
+def _is_transient(result: Dict[str, Any]) -> bool:
+    """True for failures worth retrying: no response at all, or a 5xx response."""
+    if result.get("error") != "http_request_error":
+        return False
+    status = result.get("metadata", {}).get("http_status")
+    return status is None or status >= 500
+
+
+def execute_append_batch(
+    db_metadata: Dict[str, Any], statements: List[Tuple[str, Optional[str]]]
+) -> Dict[str, Any]:
+    """Run an append batch in one round trip, retrying transient failures a bounded number of times."""
+    result: Dict[str, Any] = {}
+    for attempt in range(MAX_APPEND_ATTEMPTS):
+        if attempt:
+            time.sleep(RETRY_BACKOFF_SECONDS * (2 ** (attempt - 1)) * (1 + random.random()))
+        result = cloudflare_d1_batch(
+            account_id=db_metadata.get("account_id"),
+            database_id=db_metadata.get("database_id"),
+            api_token=db_metadata.get("api_token"),
+            statements=statements,
+        )
+        if cloudflare_d1_result_success(result) or not _is_transient(result):
+            break
+    return result
 
 
 def conversation_storage_put_message(
@@ -19,92 +148,67 @@ def conversation_storage_put_message(
     Add a new message to a specific conversation.
     If the conversation doesn't exist, create it first.
 
+    Creating the conversation, inserting the message and moving
+    latest_message_id happen in one batched transaction, so concurrent
+    appends cannot interleave between them and the whole call is a single
+    round trip. latest_message_id only ever moves to a message with a higher
+    seq, so a slow writer can never move it back to an older message.
+
     Args:
+        db_brand: Database brand, should be "cloudflare_d1_lite"
+        db_metadata: Metadata for database connection. If it contains "replica_path",
+                     the message is also written through to the local replica.
         conversation_id: Target conversation ID
         role: Message sender role ('user', 'assistant', 'system', etc.)
         text: Message content text
-        parent_message_id: Optional parent message ID for replies or edits
+        parent_message_id: Optional parent message ID for replies or edits.
+                           Defaults to the conversation's latest message at insert time.
         metadata: Optional metadata dictionary
 
     Returns:
-        {"message_id": message_id, "conversation_id": conversation_id}
+        {"message_id": message_id, "conversation_id": conversation_id, "seq": seq,
+         "parent_message_id": parent_message_id}
+        seq is the message's position in the conversation.
+
+    Raises:
+        RuntimeError: The message could not be stored. Transient failures are
+                      retried first; the error carries the last D1 response.
     """
-    # Check if conversation exists
-    sql_check = "SELECT conversation_id FROM Conversation WHERE conversation_id = ?;"
-    if db_brand == "cloudflare_d1_lite":
-        account_id = db_metadata.get("account_id")
-        database_id = db_metadata.get("database_id")
-        api_token = db_metadata.get("api_token")
-        check_result = cloudflare_d1_query(
-            account_id=account_id,
-            database_id=database_id,
-            api_token=api_token,
-            sql_query=sql_check,
-            params=f'["{conversation_id}"]',
-        )
-    else:
+    if db_brand != "cloudflare_d1_lite":
         raise ValueError("Unsupported database brand")
-    # check_result = d1_executor(sql_check, f'["{conversation_id}"]')
-    check_data = (
-        check_result.get("metadata", {}).get("result", [{}])[0].get("results", [])
-    )
+    ensure_schema(db_brand, db_metadata)
 
-    # If conversation doesn't exist, create it
-    if not check_data:
-        conversation = Conversation(conversation_id=conversation_id)
-        sql_create_conv = """
-        INSERT INTO Conversation (conversation_id, sequence, status, created_at)
-        VALUES (?, ?, ?, ?);
-        """
-        conv_values = f'["{conversation.conversation_id}", "{conversation.sequence}", "{conversation.status}", "{conversation.created_at.isoformat()}"]'
-        cloudflare_d1_query(
-            account_id=account_id,
-            database_id=database_id,
-            api_token=api_token,
-            sql_query=sql_create_conv,
-            params=conv_values,
-        )
-
-    # Now create the message
-    message_id = str(uuid.uuid4())
-    timestamp = datetime.now()
+    conversation = Conversation(conversation_id=conversation_id)
     message = Message(
         conversation_id=conversation_id,
         role=role,
         text=text,
-        message_id=message_id,
+        message_id=new_id(),
         parent_message_id=parent_message_id,
-        timestamp=timestamp,
+        timestamp=datetime.now(),
         metadata=metadata,
     )
 
-    sql_message = """
-    INSERT INTO Message (message_id, conversation_id, role, text, parent_message_id, timestamp, metadata)
-    VALUES (?, ?, ?, ?, ?, ?, ?);
-    """
-    message_values = f'["{message.message_id}", "{message.conversation_id}", "{message.role}", {json.dumps(message.text)}, {json.dumps(message.parent_message_id)}, "{message.timestamp.isoformat()}", {json.dumps(json.dumps(message.metadata) if message.metadata else None)}]'
-    # message_values = json.dumps([json.dumps(message.message_id), json.dumps(message.conversation_id), json.dumps(message.role), json.dumps(message.text), json.dumps(message.parent_message_id), json.dumps(message.timestamp.isoformat()), json.dumps(json.dumps(message.metadata) if message.metadata else None)])
-    print("message_values:",message_values)
-    cloudflare_d1_query(
-        account_id=account_id,
-        database_id=database_id,
-        api_token=api_token,
-        sql_query=sql_message,
-        params=message_values,
-    )
+    statements = [ensure_conversation_statement(conversation)]
+    statements += append_message_statements(message)
+    result = execute_append_batch(db_metadata, statements)
 
-    sql_conversation = """
-    UPDATE Conversation
-    SET latest_message_id = ?
-    WHERE conversation_id = ?;
-    """
-    conversation_values = f'["{message.message_id}", "{message.conversation_id}"]'
-    cloudflare_d1_query(
-        account_id=account_id,
-        database_id=database_id,
-        api_token=api_token,
-        sql_query=sql_conversation,
-        params=conversation_values,
-    )
+    if cloudflare_d1_result_success(result):
+        appended = result["metadata"]["result"][-1].get("results", [])
+        if appended:
+            message.seq = appended[0]["seq"]
+            message.parent_message_id = appended[0]["parent_message_id"]
+
+    forget_conversation_reads(db_metadata, conversation_id)
+    if message.seq is None:
+        raise RuntimeError(f"Failed to store message: {result}")
+    replica = get_replica(db_metadata)
+    if replica is not None:
+        replica.write_through(conversation, message)
 
-    return {"message_id": message_id, "conversation_id": conversation_id}
\ No newline at end of file
+    return {
+        "message_id": message.message_id,
+        "conversation_id": conversation_id,
+        "seq": message.seq,
+        "parent_message_id": message.parent_message_id,
+    }
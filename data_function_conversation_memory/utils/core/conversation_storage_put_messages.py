@@ -0,0 +1,117 @@
+from typing import Optional, Dict, Any, List
+from datetime import datetime
+from utils.connector import cloudflare_d1_result_success
+from .conversation_storage_dataclasses import Message, Conversation
+from .conversation_storage_ids import new_id
+from .conversation_storage_put_message import (
+    append_message_statements,
+    ensure_conversation_statement,
+    execute_append_batch,
+)
+from .conversation_storage_get_conversation import forget_conversation_reads
+from .conversation_storage_replica import get_replica
+from .conversation_storage_init_create_tables import ensure_schema
+
+# Every message adds four statements to the batch; this keeps one request
+# well inside D1's request size limits.
+MAX_MESSAGES_PER_CALL = 50
+
+
+def conversation_storage_put_messages(
+    db_brand: str,
+    db_metadata: Dict[str, Any],
+    conversation_id: str,
+    messages: List[Dict[str, Any]],
+    parent_message_id: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Add an ordered list of messages, e.g. a full user/assistant round, to a
+    conversation in one batched request.
+    If the conversation doesn't exist, create it first.
+
+    Each message is the reply to the one before it. The first message replies
+    to parent_message_id, or to the conversation's latest message if none is
+    given. The whole list is written in one transaction: either every message
+    is stored and latest_message_id points at the last one, or nothing is.
+
+    Args:
+        db_brand: Database brand, should be "cloudflare_d1_lite"
+        db_metadata: Metadata for database connection
+        conversation_id: Target conversation ID
+        messages: Messages in order, each {"role": ..., "text": ..., "metadata": {...}}.
+                  "content" is accepted in place of "text"; "metadata" is optional.
+        parent_message_id: Optional parent of the first message
+
+    Returns:
+        {"conversation_id": conversation_id, "messages": [
+            {"message_id": ..., "role": ..., "seq": ..., "parent_message_id": ...}, ...]}
+
+    Raises:
+        ValueError: messages is empty, too long, or a message lacks a role or text.
+        RuntimeError: The batch failed and nothing was stored. Transient failures
+                      are retried first; the error carries the last D1 response.
+    """
+    if db_brand != "cloudflare_d1_lite":
+        raise ValueError("Unsupported database brand")
+    if not messages:
+        raise ValueError("messages must not be empty")
+    if len(messages) > MAX_MESSAGES_PER_CALL:
+        raise ValueError(f"At most {MAX_MESSAGES_PER_CALL} messages can be stored per call")
+    ensure_schema(db_brand, db_metadata)
+
+    conversation = Conversation(conversation_id=conversation_id)
+    now = datetime.now()
+    stored: List[Message] = []
+    for item in messages:
+        role = item.get("role")
+        text = item.get("text", item.get("content"))
+        if not role or text is None:
+            raise ValueError("Every message needs a role and a text")
+        stored.append(
+            Message(
+                conversation_id=conversation_id,
+                role=role,
+                text=text,
+                message_id=new_id(),
+                parent_message_id=stored[-1].message_id if stored else parent_message_id,
+                timestamp=now,
+                metadata=item.get("metadata"),
+            )
+        )
+
+    statements = [ensure_conversation_statement(conversation)]
+    for message in stored:
+        statements += append_message_statements(message)
+    result = execute_append_batch(db_metadata, statements)
+
+    if cloudflare_d1_result_success(result):
+        # After the conversation statement, each message has one statement
+        # per append step and the last one returns its stored seq and parent.
+        steps = (len(statements) - 1) // len(stored)
+        statement_results = result["metadata"]["result"]
+        for i, message in enumerate(stored):
+            appended = statement_results[steps * (i + 1)].get("results", [])
+            if appended:
+                message.seq = appended[0]["seq"]
+                message.parent_message_id = appended[0]["parent_message_id"]
+
+    forget_conversation_reads(db_metadata, conversation_id)
+    if any(message.seq is None for message in stored):
+        raise RuntimeError(f"Failed to store messages: {result}")
+    replica = get_replica(db_metadata)
+    if replica is not None:
+        for message in stored:
+            replica.write_through(conversation, message)
+
+    return {
+        "conversation_id": conversation_id,
+        "messages": [
+            {
+                "message_id": message.message_id,
+                "role": message.role,
+                "seq": message.seq,
+                "parent_message_id": message.parent_message_id,
+            }
+            for message in stored
+        ],
+    }
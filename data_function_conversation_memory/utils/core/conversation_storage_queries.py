@@ -0,0 +1,75 @@
+from typing import List, Dict, Any, Optional
+import json
+from datetime import datetime
+from .conversation_storage_dataclasses import Conversation, Message
+
+SQL_SELECT_CONVERSATION = "SELECT * FROM Conversation WHERE conversation_id = ?;"
+
+# Params: conversation_id, before_seq, before_seq, max_round
+SQL_SELECT_MESSAGES_SEQUENTIAL = """
+        SELECT * FROM Message
+        WHERE conversation_id = ? AND (? IS NULL OR seq < ?)
+        ORDER BY seq DESC
+        LIMIT ?;
+        """
+
+SQL_SELECT_MESSAGES_TREE = """
+        SELECT * FROM Message
+        WHERE conversation_id = ? AND (? IS NULL OR seq < ?)
+        ORDER BY seq ASC
+        LIMIT ?;
+        """
+
+
+def conversation_from_row(row: Dict[str, Any]) -> Conversation:
+    """Build a Conversation from a Conversation table row."""
+    return Conversation(
+        conversation_id=row["conversation_id"],
+        project=row["project"],
+        brand=row["brand"],
+        sequence=row["sequence"],
+        status=row["status"],
+        created_at=datetime.fromisoformat(row["created_at"]),
+        latest_message_id=row["latest_message_id"],
+        metadata=json.loads(row["metadata"]) if row["metadata"] else None,
+        last_seq=row.get("last_seq") or 0,
+    )
+
+
+def message_from_row(row: Dict[str, Any]) -> Message:
+    """Build a Message from a Message table row."""
+    return Message(
+        message_id=row["message_id"],
+        conversation_id=row["conversation_id"],
+        role=row["role"],
+        text=row["text"],
+        parent_message_id=row["parent_message_id"],
+        timestamp=datetime.fromisoformat(row["timestamp"]),
+        metadata=json.loads(row["metadata"]) if row["metadata"] else None,
+        seq=row.get("seq"),
+    )
+
+
+def messages_query(conversation: Conversation, before_seq: Optional[int]) -> Optional[str]:
+    """
+    The message query for a conversation, None for an unknown sequence type.
+
+    Without before_seq a tree conversation loads from its first message. With
+    before_seq both types seek backwards from the cursor (newest first), so
+    each page holds the max_round messages just before it.
+    """
+    if conversation.sequence == "sequential":
+        return SQL_SELECT_MESSAGES_SEQUENTIAL
+    if conversation.sequence == "tree":
+        return SQL_SELECT_MESSAGES_TREE if before_seq is None else SQL_SELECT_MESSAGES_SEQUENTIAL
+    return None
+
+
+def attach_messages(conversation: Conversation, message_rows: List[Dict[str, Any]]) -> Conversation:
+    """Set conversation.messages in display order (ascending seq) from rows fetched with messages_query."""
+    message_list: List[Message] = [message_from_row(row) for row in message_rows]
+    if conversation.sequence in ("sequential", "tree"):
+        conversation.messages = sorted(message_list, key=lambda m: m.seq or 0)
+    else:
+        conversation.messages = []
+    return conversation
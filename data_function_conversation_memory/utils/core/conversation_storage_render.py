@@ -0,0 +1,120 @@
+"""
+Render conversation history as XML, JSON or a plain chat transcript.
+
+render_history() is a generator that walks the messages once and yields the
+output in pieces, so a caller can stream it or join it in one go. Message
+text is escaped for the target format: "<", ">" and "&" in a message can no
+longer break the XML a prompt is built from.
+"""
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+import json
+from xml.sax.saxutils import escape
+
+try:
+    import orjson
+except ImportError:  # listed in requirements.txt; json is the fallback when run elsewhere
+    orjson = None
+
+from .conversation_storage_dataclasses import Conversation
+
+RENDER_FORMATS = ("xml", "json", "chat")
+
+XML_NOT_FOUND = "<error>Conversation not found or this is the first message</error>"
+
+_XML_MESSAGE = """<message>
+    <role>{role}</role>
+    <content>{content}</content>
+</message>"""
+
+
+def dumps_json(value: Any) -> str:
+    """Serialize to compact JSON text, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(value).decode()
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+def message_pairs(conversation: Optional[Conversation]) -> List[Tuple[str, str]]:
+    """(role, text) of each message in display order; empty if there is no conversation."""
+    if not conversation or not conversation.messages:
+        return []
+    return [(msg.role, msg.text) for msg in conversation.messages]
+
+
+def render_history(
+    messages: Iterable[Tuple[str, str]],
+    fmt: str = "xml",
+    user_input: Optional[str] = None,
+    wrap: bool = True,
+    not_found: bool = False,
+) -> Iterator[str]:
+    """
+    Yield the rendered history piece by piece.
+
+    Args:
+        messages: (role, text) pairs in display order
+        fmt: "xml", "json" (a list of {"role", "content"}) or "chat" ("role: text" blocks)
+        user_input: Optional new user message appended after the history.
+                    In XML it goes into a separate <latest> element.
+        wrap: XML only, whether to wrap the messages in <history>
+        not_found: XML only, render the not-found marker in place of the messages
+
+    Raises:
+        ValueError: Unsupported format
+    """
+    if fmt == "xml":
+        if wrap:
+            yield "<history>\n"
+        if not_found:
+            yield XML_NOT_FOUND
+        else:
+            separator = ""
+            for role, text in messages:
+                yield separator
+                yield _XML_MESSAGE.format(role=escape(role), content=escape(text))
+                separator = "\n"
+        if wrap:
+            yield "\n</history>"
+        if user_input:
+            yield "\n<latest>" + _XML_MESSAGE.format(role="user", content=escape(user_input)) + "</latest>"
+    elif fmt == "json":
+        yield "["
+        separator = ""
+        for role, text in messages:
+            yield separator
+            yield dumps_json({"role": role, "content": text})
+            separator = ","
+        if user_input:
+            yield separator
+            yield dumps_json({"role": "user", "content": user_input})
+        yield "]"
+    elif fmt == "chat":
+        separator = ""
+        for role, text in messages:
+            yield f"{separator}{role}: {text}"
+            separator = "\n\n"
+        if user_input:
+            yield f"{separator}user: {user_input}"
+    else:
+        raise ValueError(f"Unsupported format: {fmt}, only {', '.join(RENDER_FORMATS)} are supported")
+
+
+def render_history_text(
+    messages: Iterable[Tuple[str, str]],
+    fmt: str = "xml",
+    user_input: Optional[str] = None,
+    wrap: bool = True,
+    not_found: bool = False,
+) -> str:
+    """render_history() joined into one string."""
+    return "".join(render_history(messages, fmt, user_input, wrap, not_found))
+
+
+def history_json_list(
+    messages: Iterable[Tuple[str, str]], user_input: Optional[str] = None
+) -> List[Dict[str, str]]:
+    """The history as a list of {"role", "content"} dicts, plus the optional new user message."""
+    result = [{"role": role, "content": text} for role, text in messages]
+    if user_input:
+        result.append({"role": "user", "content": user_input})
+    return result
@@ -0,0 +1,399 @@
+from typing import Optional, List, Dict, Any, Tuple
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from utils.connector import cloudflare_d1_batch, cloudflare_d1_result_success
+from .conversation_storage_dataclasses import Conversation, Message
+from .conversation_storage_init_create_tables import CONVERSATION_TABLE_SQL, MESSAGE_TABLE_SQL
+from .conversation_storage_queries import (
+    SQL_SELECT_CONVERSATION,
+    messages_query,
+    conversation_from_row,
+    attach_messages,
+)
+
+DEFAULT_MAX_STALENESS = 5.0
+# Upper bound on replica_max_staleness, whatever the caller asks for. Within
+# the staleness window reads never reach D1, so this also bounds how long a
+# revoked token can keep reading its copy.
+MAX_STALENESS = 60.0
+# A sync pulls at most this many new messages. A conversation further behind
+# than that is read from D1 directly while the replica catches up.
+DEFAULT_SYNC_BATCH = 500
+
+_REPLICA_SCHEMA = [
+    CONVERSATION_TABLE_SQL,
+    MESSAGE_TABLE_SQL,
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_message_conversation_seq ON Message (conversation_id, seq);",
+    """
+    CREATE TABLE IF NOT EXISTS ReplicaSync (
+        conversation_id TEXT PRIMARY KEY NOT NULL,
+        synced_seq INTEGER NOT NULL DEFAULT 0,
+        synced_at REAL
+    );
+    """,
+]
+
+_MESSAGE_COLUMNS = (
+    "message_id",
+    "conversation_id",
+    "role",
+    "text",
+    "parent_message_id",
+    "timestamp",
+    "metadata",
+    "seq",
+)
+_SQL_UPSERT_MESSAGE = (
+    f"INSERT OR REPLACE INTO Message ({', '.join(_MESSAGE_COLUMNS)}) "
+    f"VALUES ({', '.join('?' for _ in _MESSAGE_COLUMNS)});"
+)
+_SQL_UPSERT_CONVERSATION = """
+    INSERT INTO Conversation (conversation_id, project, brand, sequence, status, created_at, latest_message_id, metadata)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (conversation_id) DO UPDATE SET
+        project = excluded.project,
+        brand = excluded.brand,
+        sequence = excluded.sequence,
+        status = excluded.status,
+        created_at = excluded.created_at,
+        latest_message_id = excluded.latest_message_id,
+        metadata = excluded.metadata;
+"""
+
+_replicas: Dict[str, "LocalReplica"] = {}
+_replicas_lock = threading.Lock()
+
+
+def credential_tag(api_token: Optional[str]) -> str:
+    """Short, non-reversible tag of an API token, for keying per-credential state."""
+    return hashlib.sha256((api_token or "").encode()).hexdigest()[:16]
+
+
+def default_replica_path(account_id: str, database_id: str, api_token: Optional[str]) -> str:
+    """
+    Default location of the replica file for one D1 database and API token.
+
+    The file lives in the user's cache directory, not the shared temp
+    directory, and is scoped to the token: a read with another token never
+    sees rows synced with this one.
+    """
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    directory = os.path.join(cache_home, "conversation_memory_replica")
+    return os.path.join(directory, f"{account_id}-{database_id}-{credential_tag(api_token)}.sqlite3")
+
+
+def get_replica(db_metadata: Dict[str, Any]) -> Optional["LocalReplica"]:
+    """
+    Return the process-wide replica configured in db_metadata, or None when disabled.
+
+    db_metadata keys:
+        replica_path: Path of the local SQLite file. The replica is disabled when absent.
+                      Rows in the file are served without checking the API token,
+                      so use one path per token, e.g. default_replica_path().
+        replica_max_staleness: Seconds a synced conversation may be served without
+                               checking D1 again (default DEFAULT_MAX_STALENESS,
+                               at most MAX_STALENESS).
+    """
+    path = db_metadata.get("replica_path")
+    if not path:
+        return None
+    with _replicas_lock:
+        replica = _replicas.get(path)
+        if replica is None:
+            replica = LocalReplica(path)
+            _replicas[path] = replica
+    return replica
+
+
+class LocalReplica:
+    """
+    On-disk SQLite mirror of the D1 Conversation and Message tables.
+
+    Each conversation is synced on its own: the replica remembers the highest
+    seq it has pulled (the high-water mark) and when it last talked to D1.
+    Reads within the staleness bound never leave the process. Older reads
+    first pull only rows above the high-water mark, in a single batched D1
+    request, and fall back to reading D1 directly when that fails or the
+    conversation is too far behind.
+
+    The same sync also drops local rows that retention removed from D1: whole
+    conversations that no longer exist, and messages below the remote minimum
+    seq. Rows deleted from the middle of a conversation are not detected.
+    If D1 falls below the high-water mark, the local copy is dropped and
+    pulled from scratch.
+    """
+
+    def __init__(self, path: str, sync_batch: int = DEFAULT_SYNC_BATCH):
+        # Readable by this user only; SQLite gives its WAL files the same mode.
+        os.makedirs(os.path.dirname(os.path.abspath(path)), mode=0o700, exist_ok=True)
+        os.close(os.open(path, os.O_RDWR | os.O_CREAT, 0o600))
+        os.chmod(path, 0o600)
+        self.path = path
+        self.sync_batch = sync_batch
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.execute("PRAGMA synchronous = NORMAL")
+        with self._lock:
+            for sql in _REPLICA_SCHEMA:
+                self._conn.execute(sql)
+
+    # -- reads --------------------------------------------------------------
+
+    def read_conversation(
+        self,
+        db_metadata: Dict[str, Any],
+        conversation_id: str,
+        max_round: int = 10,
+        before_seq: Optional[int] = None,
+    ) -> Tuple[bool, Optional[Conversation]]:
+        """
+        Read a conversation from the replica, syncing it first if it is stale.
+
+        Returns:
+            (served, conversation). served is False when the replica could not
+            bring the conversation up to date; the caller should then read D1.
+            When served is True, conversation is None if it does not exist.
+        """
+        max_staleness = db_metadata.get("replica_max_staleness")
+        if max_staleness is None:
+            max_staleness = DEFAULT_MAX_STALENESS
+        max_staleness = min(float(max_staleness), MAX_STALENESS)
+        with self._lock:
+            state = self._conn.execute(
+                "SELECT synced_seq, synced_at FROM ReplicaSync WHERE conversation_id = ?;",
+                (conversation_id,),
+            ).fetchone()
+        fresh = (
+            state is not None
+            and state["synced_at"] is not None
+            and time.time() - state["synced_at"] <= max_staleness
+        )
+        if not fresh and not self.sync(db_metadata, conversation_id):
+            return False, None
+        return True, self._read_local(conversation_id, max_round, before_seq)
+
+    def _read_local(
+        self, conversation_id: str, max_round: int, before_seq: Optional[int]
+    ) -> Optional[Conversation]:
+        with self._lock:
+            row = self._conn.execute(SQL_SELECT_CONVERSATION, (conversation_id,)).fetchone()
+            if row is None:
+                return None
+            conversation = conversation_from_row(dict(row))
+            sql_messages = messages_query(conversation, before_seq)
+            if sql_messages is None:
+                return attach_messages(conversation, [])
+            message_rows = [
+                dict(r)
+                for r in self._conn.execute(
+                    sql_messages, (conversation_id, before_seq, before_seq, max_round)
+                )
+            ]
+        return attach_messages(conversation, message_rows)
+
+    # -- sync ---------------------------------------------------------------
+
+    def sync(self, db_metadata: Dict[str, Any], conversation_id: str) -> bool:
+        """
+        Pull rows newer than the high-water mark of one conversation from D1.
+
+        Returns:
+            True if the conversation is now fully caught up, False if D1 could
+            not be reached or more than sync_batch messages are still pending.
+        """
+        with self._lock:
+            state = self._conn.execute(
+                "SELECT synced_seq FROM ReplicaSync WHERE conversation_id = ?;",
+                (conversation_id,),
+            ).fetchone()
+        synced_seq = state["synced_seq"] if state else 0
+
+        result = cloudflare_d1_batch(
+            account_id=db_metadata.get("account_id"),
+            database_id=db_metadata.get("database_id"),
+            api_token=db_metadata.get("api_token"),
+            statements=[
+                (SQL_SELECT_CONVERSATION, json.dumps([conversation_id])),
+                (
+                    "SELECT MIN(seq) AS min_seq, MAX(seq) AS max_seq FROM Message WHERE conversation_id = ?;",
+                    json.dumps([conversation_id]),
+                ),
+                # If D1 is behind the high-water mark the mark is no longer
+                # valid, so pull from the start instead (see _apply_sync).
+                (
+                    """
+                    SELECT * FROM Message
+                    WHERE conversation_id = ?
+                      AND seq > CASE
+                          WHEN IFNULL((SELECT MAX(seq) FROM Message WHERE conversation_id = ?), 0) < ? THEN 0
+                          ELSE ?
+                      END
+                    ORDER BY seq
+                    LIMIT ?;
+                    """,
+                    json.dumps(
+                        [conversation_id, conversation_id, synced_seq, synced_seq, self.sync_batch + 1]
+                    ),
+                ),
+            ],
+        )
+        if not cloudflare_d1_result_success(result):
+            return False
+        conversation_rows, seq_range_rows, message_rows = (
+            statement.get("results", []) for statement in result["metadata"]["result"]
+        )
+        seq_range = seq_range_rows[0] if seq_range_rows else {}
+        min_seq, max_seq = seq_range.get("min_seq"), seq_range.get("max_seq")
+
+        # D1 went back below the high-water mark, e.g. seq numbers reused
+        # after deletes or the conversation recreated under the same ID: the
+        # local copy no longer matches, so it is rebuilt from the rows pulled
+        # from seq 0.
+        reset = (max_seq or 0) < synced_seq
+
+        behind = len(message_rows) > self.sync_batch
+        message_rows = message_rows[: self.sync_batch]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                if not conversation_rows:
+                    self._forget(conversation_id)
+                else:
+                    if reset:
+                        self._conn.execute(
+                            "DELETE FROM Message WHERE conversation_id = ?;", (conversation_id,)
+                        )
+                    self._apply_sync(
+                        conversation_rows[0],
+                        min_seq,
+                        message_rows,
+                        0 if reset else synced_seq,
+                        fresh=not behind,
+                    )
+                self._conn.execute("COMMIT")
+            except sqlite3.Error:
+                self._conn.execute("ROLLBACK")
+                return False
+        return not behind
+
+    def _forget(self, conversation_id: str) -> None:
+        self._conn.execute("DELETE FROM Message WHERE conversation_id = ?;", (conversation_id,))
+        self._conn.execute("DELETE FROM Conversation WHERE conversation_id = ?;", (conversation_id,))
+        # Remember that D1 has nothing, so repeated reads of an unknown ID stay local.
+        self._conn.execute(
+            "INSERT OR REPLACE INTO ReplicaSync (conversation_id, synced_seq, synced_at) VALUES (?, 0, ?);",
+            (conversation_id, time.time()),
+        )
+
+    def _apply_sync(
+        self,
+        conversation_row: Dict[str, Any],
+        min_seq: Optional[int],
+        message_rows: List[Dict[str, Any]],
+        synced_seq: int,
+        fresh: bool,
+    ) -> None:
+        conversation_id = conversation_row["conversation_id"]
+        self._conn.execute(
+            _SQL_UPSERT_CONVERSATION,
+            (
+                conversation_id,
+                conversation_row["project"],
+                conversation_row["brand"],
+                conversation_row["sequence"],
+                conversation_row["status"],
+                conversation_row["created_at"],
+                conversation_row["latest_message_id"],
+                conversation_row["metadata"],
+            ),
+        )
+        if min_seq is None:
+            self._conn.execute("DELETE FROM Message WHERE conversation_id = ?;", (conversation_id,))
+        else:
+            self._conn.execute(
+                "DELETE FROM Message WHERE conversation_id = ? AND seq < ?;",
+                (conversation_id, min_seq),
+            )
+        self._conn.executemany(
+            _SQL_UPSERT_MESSAGE,
+            ([row[column] for column in _MESSAGE_COLUMNS] for row in message_rows),
+        )
+        if message_rows:
+            synced_seq = message_rows[-1]["seq"]
+        self._conn.execute(
+            """
+            INSERT INTO ReplicaSync (conversation_id, synced_seq, synced_at) VALUES (?, ?, ?)
+            ON CONFLICT (conversation_id) DO UPDATE SET
+                synced_seq = excluded.synced_seq,
+                synced_at = excluded.synced_at;
+            """,
+            (conversation_id, synced_seq, time.time() if fresh else None),
+        )
+
+    # -- writes -------------------------------------------------------------
+
+    def write_through(self, conversation: Conversation, message: Message) -> None:
+        """
+        Apply a message that was just stored in D1 to the replica.
+
+        The conversation row is only created when missing. The high-water mark
+        moves forward only when the message directly follows it. Otherwise
+        messages written by other processes are missing in between, and the
+        conversation is marked stale so the next read pulls them first.
+        """
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO Conversation (conversation_id, sequence, status, created_at) "
+                    "VALUES (?, ?, ?, ?);",
+                    (
+                        conversation.conversation_id,
+                        conversation.sequence,
+                        conversation.status,
+                        conversation.created_at.isoformat(),
+                    ),
+                )
+                self._conn.execute(
+                    _SQL_UPSERT_MESSAGE,
+                    (
+                        message.message_id,
+                        message.conversation_id,
+                        message.role,
+                        message.text,
+                        message.parent_message_id,
+                        message.timestamp.isoformat(),
+                        json.dumps(message.metadata) if message.metadata else None,
+                        message.seq,
+                    ),
+                )
+                # Same rule as in D1: the head only moves to a higher seq.
+                self._conn.execute(
+                    """
+                    UPDATE Conversation SET latest_message_id = ?
+                    WHERE conversation_id = ?
+                      AND IFNULL((SELECT seq FROM Message WHERE message_id = Conversation.latest_message_id), 0) < ?;
+                    """,
+                    (message.message_id, message.conversation_id, message.seq),
+                )
+                self._conn.execute(
+                    "UPDATE ReplicaSync SET synced_seq = ? WHERE conversation_id = ? AND synced_seq = ?;",
+                    (message.seq, message.conversation_id, message.seq - 1),
+                )
+                # Messages from other writers are missing in between: mark the
+                # conversation stale so the next read syncs instead of serving
+                # history with a gap.
+                self._conn.execute(
+                    "UPDATE ReplicaSync SET synced_at = NULL WHERE conversation_id = ? AND synced_seq < ?;",
+                    (message.conversation_id, message.seq - 1),
+                )
+                self._conn.execute("COMMIT")
+            except sqlite3.Error:
+                self._conn.execute("ROLLBACK")
@@ -0,0 +1,463 @@
+from dataclasses import dataclass, fields
+from datetime import datetime, timedelta
+from typing import Optional, List, Dict, Any, Tuple, Union
+import json
+import time
+
+from utils.connector import (
+    cloudflare_d1_query,
+    cloudflare_d1_batch,
+    cloudflare_d1_result_success,
+)
+from .conversation_storage_init_create_tables import ensure_schema
+
+# D1 rejects statements with more than 100 bound parameters. Pages of
+# conversation IDs are bound one parameter per ID next to a few other values,
+# so a chunk can hold at most 50 IDs.
+MAX_CHUNK_SIZE = 50
+
+# Message IDs of a chunk are bound as one JSON array parameter.
+_IN_IDS = "IN (SELECT value FROM json_each(?))"
+
+# Guards for deleting from conversations judged inactive: they only match while
+# the conversation still has no message at or after the cutoff, so a message
+# posted during the run keeps the whole conversation.
+_MESSAGE_STILL_INACTIVE = (
+    "(SELECT MAX(x.timestamp) FROM Message x WHERE x.conversation_id = Message.conversation_id) < ?"
+)
+_CONVERSATION_STILL_INACTIVE = (
+    "IFNULL((SELECT MAX(x.timestamp) FROM Message x WHERE x.conversation_id = Conversation.conversation_id), "
+    "Conversation.created_at) < ?"
+)
+
+_PAYLOAD_BYTES = "LENGTH(CAST(m.text AS BLOB)) + IFNULL(LENGTH(CAST(m.metadata AS BLOB)), 0)"
+
+
+@dataclass
+class RetentionPolicy:
+    """
+    A retention rule applied to the conversations of one project / brand.
+
+    Attributes:
+        project: Only conversations with this project are affected. None matches any project.
+        brand: Only conversations with this brand are affected. None matches any brand.
+        max_age_days: Delete messages older than this many days.
+        max_messages_per_conversation: Keep only the newest N messages of each conversation.
+        inactive_days: Delete whole conversations without any message in this many days.
+    """
+
+    project: Optional[str] = None
+    brand: Optional[str] = None
+    max_age_days: Optional[float] = None
+    max_messages_per_conversation: Optional[int] = None
+    inactive_days: Optional[float] = None
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "RetentionPolicy":
+        known = {f.name for f in fields(cls)}
+        unknown = set(data) - known
+        if unknown:
+            raise ValueError(f"Unknown retention policy fields: {sorted(unknown)}")
+        return cls(**data)
+
+
+def conversation_storage_retention(
+    db_brand: str,
+    db_metadata: Dict[str, Any],
+    policies: List[Union[RetentionPolicy, Dict[str, Any]]],
+    dry_run: bool = False,
+    chunk_size: int = MAX_CHUNK_SIZE,
+    max_chunks: Optional[int] = None,
+    cursor: Optional[Dict[str, Any]] = None,
+    pause_seconds: float = 0.0,
+) -> Dict[str, Any]:
+    """
+    Apply retention policies, deleting expired rows in small index-driven chunks.
+
+    Every chunk is one bounded SELECT plus one batched DELETE, so no single
+    query holds the database for long. Runs can be split over several calls:
+    pass max_chunks to bound the work done by one call and feed the returned
+    cursor into the next call (with the same policies) to continue.
+
+    In dry_run mode each rule is counted on its own, so a row matched by two
+    rules is reported twice.
+
+    Args:
+        db_brand: Database brand, should be "cloudflare_d1_lite"
+        db_metadata: Metadata for database connection
+        policies: RetentionPolicy objects or dicts with the same fields
+        dry_run: Only count what would be deleted, do not delete anything
+        chunk_size: Maximum rows touched per chunk (capped at MAX_CHUNK_SIZE)
+        max_chunks: Stop after this many chunks and return a cursor. None runs to completion.
+        cursor: Cursor returned by a previous, unfinished run
+        pause_seconds: Sleep between chunks to leave room for foreground traffic
+
+    Returns:
+        {
+            "dry_run": bool,
+            "completed": bool,
+            "cursor": None when completed, otherwise the cursor to resume from,
+            "chunks": number of chunks processed,
+            "messages_deleted": messages deleted (or that would be, when dry_run),
+            "conversations_deleted": conversations deleted (or that would be, when dry_run),
+            "bytes_reclaimed": approximate payload bytes of the deleted rows,
+            "error": present only if a query failed; the run can be resumed from cursor,
+        }
+    """
+    if db_brand != "cloudflare_d1_lite":
+        raise ValueError("Unsupported database brand")
+    ensure_schema(db_brand, db_metadata)
+
+    policies = [
+        p if isinstance(p, RetentionPolicy) else RetentionPolicy.from_dict(p)
+        for p in policies
+    ]
+    chunk_size = max(1, min(int(chunk_size), MAX_CHUNK_SIZE))
+
+    run = _RetentionRun(
+        db_metadata=db_metadata,
+        dry_run=dry_run,
+        chunk_size=chunk_size,
+        max_chunks=max_chunks,
+        pause_seconds=pause_seconds,
+    )
+
+    steps = _policy_steps(policies)
+    step_index = cursor.get("step", 0) if cursor else 0
+    after = cursor.get("after") if cursor else None
+    now = datetime.now()
+
+    try:
+        while step_index < len(steps):
+            policy, rule = steps[step_index]
+            if rule == "max_age":
+                after = run.apply_max_age(policy, now, after)
+            elif rule == "max_messages":
+                after = run.apply_max_messages(policy, after)
+            else:
+                after = run.apply_inactive(policy, now, after)
+            if run.exhausted:
+                break
+            step_index += 1
+            after = None
+    except RuntimeError as e:
+        run.report["error"] = str(e)
+        after = run.resume_after if run.resume_after is not None else after
+
+    completed = step_index >= len(steps)
+    run.report["completed"] = completed
+    run.report["cursor"] = None if completed else {"step": step_index, "after": after}
+    return run.report
+
+
+def _policy_steps(policies: List[RetentionPolicy]) -> List[Tuple[RetentionPolicy, str]]:
+    """Flatten policies into an ordered list of (policy, rule) steps."""
+    steps = []
+    for policy in policies:
+        if policy.max_age_days is not None:
+            steps.append((policy, "max_age"))
+        if policy.max_messages_per_conversation is not None:
+            steps.append((policy, "max_messages"))
+        if policy.inactive_days is not None:
+            steps.append((policy, "inactive"))
+    return steps
+
+
+def _scope_filter(policy: RetentionPolicy) -> Tuple[str, List[Any]]:
+    """SQL condition on Conversation alias c restricting it to the policy scope."""
+    return (
+        "(? IS NULL OR c.project = ?) AND (? IS NULL OR c.brand = ?)",
+        [policy.project, policy.project, policy.brand, policy.brand],
+    )
+
+
+def _placeholders(values: List[Any]) -> str:
+    return ", ".join("?" for _ in values)
+
+
+class _RetentionRun:
+    """Mutable state of one retention call: chunk budget, counters and D1 access."""
+
+    def __init__(
+        self,
+        db_metadata: Dict[str, Any],
+        dry_run: bool,
+        chunk_size: int,
+        max_chunks: Optional[int],
+        pause_seconds: float,
+    ):
+        self.account_id = db_metadata.get("account_id")
+        self.database_id = db_metadata.get("database_id")
+        self.api_token = db_metadata.get("api_token")
+        self.dry_run = dry_run
+        self.chunk_size = chunk_size
+        self.max_chunks = max_chunks
+        self.pause_seconds = pause_seconds
+        self.exhausted = False
+        # Keyset position to resume from if a query fails mid-step.
+        self.resume_after: Optional[List[Any]] = None
+        self.report: Dict[str, Any] = {
+            "dry_run": dry_run,
+            "chunks": 0,
+            "messages_deleted": 0,
+            "conversations_deleted": 0,
+            "bytes_reclaimed": 0,
+        }
+
+    # -- chunk budget -------------------------------------------------------
+
+    def _take_chunk(self) -> bool:
+        """Reserve one chunk of work. Returns False once the budget is spent."""
+        if self.max_chunks is not None and self.report["chunks"] >= self.max_chunks:
+            self.exhausted = True
+            return False
+        if self.report["chunks"] and self.pause_seconds:
+            time.sleep(self.pause_seconds)
+        self.report["chunks"] += 1
+        return True
+
+    # -- D1 access ----------------------------------------------------------
+
+    def _select(self, sql: str, params: List[Any]) -> List[Dict[str, Any]]:
+        result = cloudflare_d1_query(
+            account_id=self.account_id,
+            database_id=self.database_id,
+            api_token=self.api_token,
+            sql_query=sql,
+            params=json.dumps(params),
+        )
+        if not cloudflare_d1_result_success(result):
+            raise RuntimeError(f"Retention query failed: {result}")
+        return result["metadata"]["result"][0].get("results", [])
+
+    def _batch(self, statements: List[Tuple[str, List[Any]]]) -> List[Dict[str, Any]]:
+        """Run statements in one transaction; returns the per-statement results."""
+        result = cloudflare_d1_batch(
+            account_id=self.account_id,
+            database_id=self.database_id,
+            api_token=self.api_token,
+            statements=[(sql, json.dumps(params)) for sql, params in statements],
+        )
+        if not cloudflare_d1_result_success(result):
+            raise RuntimeError(f"Retention delete failed: {result}")
+        return result["metadata"]["result"]
+
+    def _delete_messages(self, rows: List[Dict[str, Any]], inactive_before: Optional[str] = None) -> None:
+        """Delete one chunk of messages, detaching surviving replies first.
+
+        Message.parent_message_id cascades on delete, so without the detach
+        step removing an old message would also remove every newer message
+        that replies to it.
+
+        With inactive_before, every statement only touches conversations that
+        still have no message at or after it, checked in the same transaction.
+        """
+        ids = [row["message_id"] for row in rows]
+        if self.dry_run:
+            deleted = len(ids)
+        else:
+            id_list = json.dumps(ids)
+            message_guard, conversation_guard, guard_params = "", "", []
+            if inactive_before is not None:
+                message_guard = f" AND {_MESSAGE_STILL_INACTIVE}"
+                conversation_guard = f" AND {_CONVERSATION_STILL_INACTIVE}"
+                guard_params = [inactive_before]
+            results = self._batch(
+                [
+                    (
+                        f"UPDATE Message SET parent_message_id = NULL "
+                        f"WHERE parent_message_id {_IN_IDS} AND message_id NOT {_IN_IDS}{message_guard};",
+                        [id_list, id_list, *guard_params],
+                    ),
+                    (
+                        f"UPDATE Conversation SET latest_message_id = NULL "
+                        f"WHERE latest_message_id {_IN_IDS}{conversation_guard};",
+                        [id_list, *guard_params],
+                    ),
+                    (f"DELETE FROM Message WHERE message_id {_IN_IDS}{message_guard};", [id_list, *guard_params]),
+                ]
+            )
+            deleted = results[-1].get("meta", {}).get("changes", len(ids))
+        self.report["messages_deleted"] += deleted
+        if deleted:
+            self.report["bytes_reclaimed"] += sum(row["bytes"] or 0 for row in rows)
+
+    # -- rules --------------------------------------------------------------
+
+    def apply_max_age(
+        self, policy: RetentionPolicy, now: datetime, after: Optional[List[Any]]
+    ) -> Optional[List[Any]]:
+        """Delete messages older than max_age_days, oldest first."""
+        cutoff = (now - timedelta(days=policy.max_age_days)).isoformat()
+        scope_sql, scope_params = _scope_filter(policy)
+        after = after or ["", ""]
+        sql = f"""
+        SELECT m.message_id, m.timestamp, {_PAYLOAD_BYTES} AS bytes
+        FROM Message m
+        WHERE m.timestamp < ?
+          AND (m.timestamp, m.message_id) > (?, ?)
+          AND m.conversation_id IN (
+              SELECT c.conversation_id FROM Conversation c WHERE {scope_sql}
+          )
+        ORDER BY m.timestamp, m.message_id
+        LIMIT ?;
+        """
+        while self._take_chunk():
+            self.resume_after = after
+            rows = self._select(sql, [cutoff, *after, *scope_params, self.chunk_size])
+            if not rows:
+                return after
+            self._delete_messages(rows)
+            after = [rows[-1]["timestamp"], rows[-1]["message_id"]]
+            if len(rows) < self.chunk_size:
+                return after
+        return after
+
+    def _conversation_page(
+        self, policy: RetentionPolicy, after: str, extra_sql: str = "", extra_params: Optional[List[Any]] = None
+    ) -> List[Dict[str, Any]]:
+        scope_sql, scope_params = _scope_filter(policy)
+        sql = f"""
+        SELECT c.conversation_id, IFNULL(LENGTH(CAST(c.metadata AS BLOB)), 0) AS bytes
+        FROM Conversation c
+        WHERE {scope_sql} AND c.conversation_id > ? {extra_sql}
+        ORDER BY c.conversation_id
+        LIMIT ?;
+        """
+        return self._select(sql, [*scope_params, after, *(extra_params or []), self.chunk_size])
+
+    def apply_max_messages(
+        self, policy: RetentionPolicy, after: Optional[List[Any]]
+    ) -> Optional[List[Any]]:
+        """Trim every conversation in scope down to its newest N messages.
+
+        Conversations are paged by ID, and only those with more than N
+        messages are returned. Each one is then trimmed oldest first, in
+        chunks keyset-paged by seq on the (conversation_id, seq) index. The
+        cursor is [last finished conversation, conversation in progress,
+        last seq handled in it].
+        """
+        keep = policy.max_messages_per_conversation
+        if keep > 0:
+            # seq of the Nth newest message; everything below it is excess.
+            # Reading it walks at most N index entries of one conversation.
+            excess_filter = (
+                "m.seq < (SELECT k.seq FROM Message k WHERE k.conversation_id = m.conversation_id "
+                "ORDER BY k.seq DESC LIMIT 1 OFFSET ?)"
+            )
+            excess_params = [keep - 1]
+            # Only conversations that have more than N messages.
+            page_sql = (
+                "AND EXISTS (SELECT 1 FROM Message k WHERE k.conversation_id = c.conversation_id "
+                "ORDER BY k.seq DESC LIMIT 1 OFFSET ?)"
+            )
+            page_params = [keep]
+        else:
+            excess_filter, excess_params = "1", []
+            page_sql = "AND EXISTS (SELECT 1 FROM Message k WHERE k.conversation_id = c.conversation_id)"
+            page_params = []
+        excess_sql = f"""
+        SELECT m.message_id, m.seq, {_PAYLOAD_BYTES} AS bytes
+        FROM Message m
+        WHERE m.conversation_id = ? AND m.seq > ? AND {excess_filter}
+        ORDER BY m.seq
+        LIMIT ?;
+        """
+
+        done, partial, partial_seq = (list(after or []) + ["", None, None])[:3]
+        while not self.exhausted:
+            self.resume_after = [done, partial, partial_seq]
+            if not self._take_chunk():
+                break
+            page = self._conversation_page(policy, done, page_sql, page_params)
+            if not page:
+                return [done, None, None]
+            for row in page:
+                conversation_id = row["conversation_id"]
+                last_seq = partial_seq if conversation_id == partial else None
+                while True:
+                    self.resume_after = [done, conversation_id, last_seq]
+                    if not self._take_chunk():
+                        return self.resume_after
+                    rows = self._select(
+                        excess_sql,
+                        [conversation_id, last_seq or 0, *excess_params, self.chunk_size],
+                    )
+                    if rows:
+                        self._delete_messages(rows)
+                        last_seq = rows[-1]["seq"]
+                    if len(rows) < self.chunk_size:
+                        break
+                done, partial, partial_seq = conversation_id, None, None
+            if len(page) < self.chunk_size:
+                return [done, None, None]
+        return [done, partial, partial_seq]
+
+    def apply_inactive(
+        self, policy: RetentionPolicy, now: datetime, after: Optional[List[Any]]
+    ) -> Optional[List[Any]]:
+        """Delete conversations, and their messages, that went quiet before the cutoff."""
+        cutoff = (now - timedelta(days=policy.inactive_days)).isoformat()
+        after = after or [""]
+        inactive_sql = """
+        AND IFNULL(
+            (SELECT MAX(m.timestamp) FROM Message m WHERE m.conversation_id = c.conversation_id),
+            c.created_at
+        ) < ?
+        """
+        while not self.exhausted:
+            self.resume_after = after
+            if not self._take_chunk():
+                break
+            page = self._conversation_page(policy, after[0], inactive_sql, [cutoff])
+            if not page:
+                return after
+            conversation_ids = [row["conversation_id"] for row in page]
+            marks = _placeholders(conversation_ids)
+
+            if self.dry_run:
+                totals = self._select(
+                    f"SELECT COUNT(*) AS messages, SUM({_PAYLOAD_BYTES}) AS bytes "
+                    f"FROM Message m WHERE m.conversation_id IN ({marks});",
+                    conversation_ids,
+                )[0]
+                self.report["messages_deleted"] += totals["messages"] or 0
+                self.report["bytes_reclaimed"] += totals["bytes"] or 0
+                deleted = len(conversation_ids)
+            else:
+                first = True
+                while True:
+                    if not first and not self._take_chunk():
+                        return after
+                    first = False
+                    # Re-check inactivity on every chunk: a conversation that
+                    # got a new message since the page was read is skipped.
+                    rows = self._select(
+                        f"SELECT m.message_id, {_PAYLOAD_BYTES} AS bytes FROM Message m "
+                        f"WHERE m.conversation_id IN ({marks}) "
+                        f"AND (SELECT MAX(x.timestamp) FROM Message x WHERE x.conversation_id = m.conversation_id) < ? "
+                        f"LIMIT ?;",
+                        [*conversation_ids, cutoff, self.chunk_size],
+                    )
+                    if not rows:
+                        break
+                    self._delete_messages(rows, inactive_before=cutoff)
+                results = self._batch(
+                    [
+                        (
+                            f"DELETE FROM Conversation WHERE conversation_id IN ({marks}) "
+                            f"AND {_CONVERSATION_STILL_INACTIVE};",
+                            [*conversation_ids, cutoff],
+                        )
+                    ]
+                )
+                deleted = results[-1].get("meta", {}).get("changes", len(conversation_ids))
+                if deleted < len(conversation_ids):
+                    page = []  # some came back to life; skip the approximate byte count
+
+            self.report["conversations_deleted"] += deleted
+            self.report["bytes_reclaimed"] += sum(row["bytes"] or 0 for row in page)
+            after = [conversation_ids[-1]]
+            if len(page) < self.chunk_size:
+                return after
+        return after
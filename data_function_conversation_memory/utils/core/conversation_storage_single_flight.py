@@ -0,0 +1,151 @@
+"""
+Single-flight coalescing for concurrent identical reads.
+
+When parallel workflow nodes ask for the same conversation window at the same
+moment, only the first caller (the leader) runs the fetch; every other caller
+with the same key waits for that result instead of issuing its own D1
+queries. Only calls that overlap are coalesced: once a flight finishes, the
+next call with the same key starts a new one. Nothing is cached.
+
+Waiters share the leader's result object, so callers must treat it as
+read-only. If the fetch raises, every waiter receives the same exception.
+"""
+import asyncio
+import threading
+from typing import Any, Callable, Dict, Hashable, List, Optional, TypeVar
+
+T = TypeVar("T")
+
+# Waiters give up after this long by default; the fetch itself keeps running
+# for whoever else is waiting on it.
+DEFAULT_TIMEOUT_SECONDS = 30.0
+
+
+class _Flight:
+    """One in-flight call and its outcome."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self._lock = threading.Lock()
+        self._callbacks: List[Callable[[], None]] = []
+
+    def finish(self, result: Any = None, error: Optional[BaseException] = None) -> None:
+        self.result, self.error = result, error
+        with self._lock:
+            self.done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def add_done_callback(self, callback: Callable[[], None]) -> None:
+        """Call callback once the flight finishes, immediately if it already has."""
+        with self._lock:
+            if not self.done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def outcome(self) -> Any:
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class SingleFlight:
+    """
+    Collapse concurrent calls with the same key into one execution.
+
+    do() is for synchronous callers (threads or gevent greenlets), do_async()
+    for coroutines. Both share one registry, so an async caller joins a flight
+    started by a sync caller and vice versa.
+
+    The fetch runs on its own thread, so the timeout bounds the leader as well
+    as the waiters. A caller that times out gets TimeoutError while the fetch
+    keeps serving the others.
+    """
+
+    def __init__(self, timeout: Optional[float] = DEFAULT_TIMEOUT_SECONDS):
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._flights: Dict[Hashable, _Flight] = {}
+
+    def do(self, key: Hashable, fn: Callable[[], T], timeout: Optional[float] = None) -> T:
+        """
+        Run fn() unless a call with the same key is already in flight, in which
+        case wait for that call and return its result.
+
+        Raises:
+            TimeoutError: The result did not arrive within the timeout.
+            Any exception raised by fn().
+        """
+        flight = self._join(key, fn)
+        if not flight.done.wait(self.timeout if timeout is None else timeout):
+            raise TimeoutError(f"single-flight call {key!r} timed out")
+        return flight.outcome()
+
+    async def do_async(self, key: Hashable, fn: Callable[[], T], timeout: Optional[float] = None) -> T:
+        """
+        Async variant of do(). fn is the same blocking callable; it never runs
+        on the event loop, and waiting does not hold a thread per caller.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def resolve() -> None:
+            if not future.done():
+                future.set_result(None)
+
+        def wake() -> None:
+            try:
+                loop.call_soon_threadsafe(resolve)
+            except RuntimeError:  # the loop closed after this caller timed out
+                pass
+
+        flight = self._join(key, fn)
+        flight.add_done_callback(wake)
+        try:
+            await asyncio.wait_for(future, self.timeout if timeout is None else timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"single-flight call {key!r} timed out") from None
+        return flight.outcome()
+
+    def forget(self, match: Callable[[Hashable], bool]) -> int:
+        """
+        Detach in-flight calls whose key matches, so later callers start a new
+        flight instead of joining one that began before, e.g., a write.
+        Callers already waiting still get the old flight's result.
+
+        Returns:
+            Number of flights detached.
+        """
+        with self._lock:
+            keys = [key for key in self._flights if match(key)]
+            for key in keys:
+                del self._flights[key]
+        return len(keys)
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._flights)
+
+    def _join(self, key: Hashable, fn: Callable[[], Any]) -> _Flight:
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                return flight
+            flight = self._flights[key] = _Flight()
+        threading.Thread(target=self._run, args=(key, flight, fn), daemon=True).start()
+        return flight
+
+    def _run(self, key: Hashable, flight: _Flight, fn: Callable[[], Any]) -> None:
+        result, error = None, None
+        try:
+            result = fn()
+        except BaseException as e:  # handed to every waiter
+            error = e
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight.finish(result, error)